@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmarks of the hot paths of dmon.
+
+They run offline. Besides the fixtures in test/res, a repository with
+`--days` days of generated rates files is written to a temporary
+directory and imported into a temporary cache database, and the
+remote rate sources are disabled. Run them from the root of the
+project:
+
+    python -m bench.benchmarks -o results.json
+    python -m bench.benchmarks -k money_ -o results.json
+
+The results are written as JSON, with the best and median time per
+call of each benchmark, in seconds, and the commit they were run on.
+Two result files, say from two commits, are compared with:
+
+    python -m bench.benchmarks --compare base.json results.json
+
+which prints the ratio of the times of each benchmark and exits with
+an error if any of them is more than `--threshold` times slower.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from itertools import cycle
+from typing import Any, Callable, Dict, List, Optional
+
+from dmon import bulk, rates
+from dmon.currency import Currency
+from dmon.money import Ledger, Money
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, "test", "res")
+
+# The fixtures have rates for this date.
+FIXTURE_DATE = date(2022, 7, 14)
+# The generated rates start on this date, and every GAP-th day is missing.
+FIRST_DATE = date(2015, 1, 1)
+GAP = 7
+
+Benchmark = Callable[[], Any]
+BENCHMARKS: Dict[str, Callable[["BenchEnvironment"], Benchmark]] = {}
+
+
+def benchmark(name: str) -> Callable:
+    """Registers a benchmark. The decorated function is called once
+    with the environment, and returns the function that is timed."""
+
+    def register(setup: Callable[["BenchEnvironment"], Benchmark]):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+def generate_rates_repo(repo_dir: str, days: int, seed: int = 0) -> List[date]:
+    """Writes the rates files of `days` days from FIRST_DATE in the
+    money directory of `repo_dir`, leaving out every GAP-th day.
+    Returns the dates written."""
+    rng = random.Random(seed)
+    money_dir = os.path.join(repo_dir, "money")
+    os.makedirs(money_dir, exist_ok=True)
+
+    base = {currency.value.upper(): rng.uniform(0.1, 1000) for currency in Currency}
+    base["USD"] = 1
+    written = []
+    for day in range(days):
+        if day % GAP == GAP - 1:
+            continue
+        dt = FIRST_DATE + timedelta(days=day)
+        conversion_rates = {
+            code: rate if code == "USD" else round(rate * rng.uniform(0.95, 1.05), 6)
+            for code, rate in base.items()
+        }
+        path = os.path.join(money_dir, rates.format_date(dt) + "-rates.json")
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump({"conversion_rates": conversion_rates}, file)
+        written.append(dt)
+    return written
+
+
+class BenchEnvironment:
+    """Temporary rates repository and cache database, with the rates
+    of the fixtures and of the generated days, set up as the rates
+    configuration of the process while in a `with` block."""
+
+    def __init__(self, days: int, seed: int = 0) -> None:
+        self.days = days
+        self.seed = seed
+        self.dates: List[date] = []
+        self._saved_env: Dict[str, Optional[str]] = {}
+
+    def __enter__(self) -> "BenchEnvironment":
+        self.dir = tempfile.mkdtemp(prefix="dmon-bench-")
+        self.repo = os.path.join(self.dir, "repo")
+        self.cache = os.path.join(self.dir, "cache")
+        os.makedirs(self.cache)
+        shutil.copy(os.path.join(FIXTURES, "exchange-rates.db"), self.cache)
+        self.dates = generate_rates_repo(self.repo, self.days, self.seed)
+
+        # Loading .env first keeps it from enabling the remote sources.
+        rates.load_env()
+        environment = {
+            "DMON_RATES_REPO": self.repo,
+            "DMON_RATES_CACHE": self.cache,
+            "DMON_EXCHANGERATE_API_KEY": "",
+            "SUPABASE_URL": "",
+            "SUPABASE_KEY": "",
+        }
+        for name, value in environment.items():
+            self._saved_env[name] = os.environ.get(name)
+            os.environ[name] = value
+
+        rates.close_db_connections()
+        rates.load_snapshot(None)
+        rates.fill_cache_db()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        rates.close_db_connections()
+        rates.clear_rates_cache()
+        rates.RATE_RESOLUTIONS.clear()
+        for name, value in self._saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def gap_dates(self) -> List[date]:
+        """Dates with no rates, whose previous day has them."""
+        available = set(self.dates)
+        return [
+            dt + timedelta(days=1) for dt in self.dates if dt + timedelta(days=1) not in available
+        ]
+
+
+@benchmark("money_construction")
+def bench_money_construction(env: BenchEnvironment) -> Benchmark:
+    Eur = Money(Currency.EUR, FIXTURE_DATE)
+    return lambda: (Eur(40), Eur("1234c", "usd"), Eur("20.10", "$", "2022-01-07"))
+
+
+@benchmark("money_parse")
+def bench_money_parse(env: BenchEnvironment) -> Benchmark:
+    Eur = Money(Currency.EUR, FIXTURE_DATE)
+    return lambda: (Eur.parse("2022-07-14 USD 20.10"), Eur.parse("EUR 20.00"))
+
+
+@benchmark("bulk_parse_records_1000")
+def bench_bulk_parse(env: BenchEnvironment) -> Benchmark:
+    Eur = Money(Currency.EUR, FIXTURE_DATE)
+    records = [
+        f"2022-07-{1 + i % 28:02d} {('USD', 'EUR', 'GBP')[i % 3]} {i}.25" for i in range(1000)
+    ]
+    return lambda: list(bulk.parse_records(records, Eur))
+
+
+def _cross_currency_pairs(backend: str) -> List:
+    Eur = Money(Currency.EUR, FIXTURE_DATE, backend=backend)
+    return [(Eur(40), Eur(20, "usd")), (Eur(10, "aud"), Eur(20, "gbp")), (Eur(1), Eur(2))]
+
+
+@benchmark("money_add_cross_currency")
+def bench_money_add(env: BenchEnvironment) -> Benchmark:
+    pairs = _cross_currency_pairs("decimal")
+    return lambda: [a + b for a, b in pairs]
+
+
+@benchmark("money_add_cross_currency_int")
+def bench_money_add_int(env: BenchEnvironment) -> Benchmark:
+    pairs = _cross_currency_pairs("int")
+    return lambda: [a + b for a, b in pairs]
+
+
+@benchmark("money_eq_cross_currency")
+def bench_money_eq(env: BenchEnvironment) -> Benchmark:
+    pairs = _cross_currency_pairs("decimal")
+    return lambda: [a == b for a, b in pairs]
+
+
+def _mixed_amounts(n: int) -> List:
+    Eur = Money(Currency.EUR, FIXTURE_DATE)
+    currencies = ["eur", "usd", "aud", "gbp"]
+    return [Eur(i % 97, currencies[i % len(currencies)]) for i in range(n)]
+
+
+@benchmark("money_sum_1000")
+def bench_money_sum(env: BenchEnvironment) -> Benchmark:
+    amounts = _mixed_amounts(1000)
+    return lambda: sum(amounts, amounts[0] * 0)
+
+
+@benchmark("ledger_total_1000")
+def bench_ledger_total(env: BenchEnvironment) -> Benchmark:
+    amounts = _mixed_amounts(1000)
+    return lambda: Ledger(items=amounts).total()
+
+
+@benchmark("get_rates_hit")
+def bench_get_rates_hit(env: BenchEnvironment) -> Benchmark:
+    rates.get_rates(FIXTURE_DATE)
+    return lambda: rates.get_rates(FIXTURE_DATE, Currency.EUR, Currency.AUD)
+
+
+@benchmark("get_rates_miss")
+def bench_get_rates_miss(env: BenchEnvironment) -> Benchmark:
+    dates = cycle(random.Random(env.seed).sample(env.dates, min(len(env.dates), 500)))
+
+    def get_rates_miss() -> Any:
+        rates.clear_rates_cache()
+        return rates.get_rates(next(dates), Currency.EUR, Currency.AUD)
+
+    return get_rates_miss
+
+
+@benchmark("find_rates_for_date_fallback")
+def bench_find_rates_fallback(env: BenchEnvironment) -> Benchmark:
+    dates = cycle(env.gap_dates())
+    return lambda: rates.find_rates_for_date(next(dates))
+
+
+@benchmark("fill_cache_db")
+def bench_fill_cache_db(env: BenchEnvironment) -> Benchmark:
+    return lambda: rates.fill_cache_db(force=True)
+
+
+def time_benchmark(func: Benchmark, repeat: int, min_time: float) -> Dict[str, Any]:
+    """Times `func` like timeit does: each of the `repeat` rounds calls
+    it a number of times chosen so that a round lasts at least
+    `min_time` seconds. Returns the times per call."""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9)))
+
+    times = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) / number)
+    return {
+        "best": min(times),
+        "median": statistics.median(times),
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+def run_benchmarks(
+    names: Optional[List[str]] = None,
+    days: int = 2000,
+    repeat: int = 5,
+    min_time: float = 0.2,
+) -> Dict[str, Any]:
+    """Runs the benchmarks in `names`, or all of them, and returns the
+    results together with a description of where they were run."""
+    results = {}
+    # The rate sources log their progress, and fail to pull the
+    # repository of the environment, which is not a git repository.
+    level = rates.log.level
+    rates.log.setLevel(logging.ERROR)
+    try:
+        with BenchEnvironment(days) as env:
+            for name in names or list(BENCHMARKS):
+                func = BENCHMARKS[name](env)
+                results[name] = time_benchmark(func, repeat, min_time)
+                rates.clear_rates_cache()
+                rates.RATE_RESOLUTIONS.clear()
+    finally:
+        rates.log.setLevel(level)
+
+    return {
+        "commit": git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "days": days,
+        "benchmarks": results,
+    }
+
+
+def git_commit() -> Optional[str]:
+    import subprocess
+
+    try:
+        return subprocess.run(
+            ["git", "-C", ROOT, "rev-parse", "--short", "HEAD"],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(base: Dict[str, Any], new: Dict[str, Any], threshold: float) -> int:
+    """Prints the ratio new/base of the best times of the benchmarks in
+    both results. Returns the number that are slower than `threshold`."""
+    print(f"{'benchmark':34} {base.get('commit') or 'base':>12} {new.get('commit') or 'new':>12}")
+    regressions = 0
+    for name, result in new["benchmarks"].items():
+        if name not in base["benchmarks"]:
+            continue
+        before, after = base["benchmarks"][name]["best"], result["best"]
+        ratio = after / before
+        flag = ""
+        if ratio > threshold:
+            regressions += 1
+            flag = "  slower"
+        print(f"{name:34} {before * 1e6:10.1f}us {after * 1e6:10.1f}us  x{ratio:.2f}{flag}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks of dmon")
+    parser.add_argument("-o", "--output", help="File to write the results to, else stdout")
+    parser.add_argument(
+        "-k", dest="pattern", help="Only run the benchmarks whose name contains this"
+    )
+    parser.add_argument("--days", type=int, default=2000, help="Days of generated rates")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="Seconds per round")
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("BASE", "NEW"), help="Compare two results files"
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=1.2, help="Slowdown ratio considered a regression"
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as base, open(args.compare[1]) as new:
+            regressions = compare_results(json.load(base), json.load(new), args.threshold)
+        sys.exit(1 if regressions else 0)
+
+    names = [name for name in BENCHMARKS if not args.pattern or args.pattern in name]
+    results = run_benchmarks(names, args.days, args.repeat, args.min_time)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
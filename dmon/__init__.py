@@ -1,2 +1,2 @@
-from .money import Money
+from .money import Money, Ledger
 from .currency import Currency
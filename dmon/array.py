@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+
+"""Columnar arrays of dated monetary values.
+
+A `MoneyArray` holds many amounts as three NumPy arrays: the amounts
+as integers in fixed-point units (`10**scale` units per cent), the
+index of their currency in `CURRENCIES`, and the ordinal of their date
+(0 when the amount has no date). Its operations follow the semantics
+of the money class it is bound to, as created by `dmon.Money`, but
+work on whole columns at once: the rates are fetched once per distinct
+date, and conversions are computed in float64 and rounded to the
+array's units.
+
+NumPy is an optional dependency: `pip install dated-money[array]`.
+"""
+
+from datetime import date
+from decimal import Decimal
+from typing import Iterable, List, Optional, Sequence, Type, Union
+
+try:
+    import numpy as np
+except ImportError as e:  # pragma: no cover
+    raise ImportError(
+        "dmon.array requires numpy, install it with: pip install dated-money[array]"
+    ) from e
+
+from dmon.currency import Currency, to_currency_enum
+from dmon.money import BaseMoney, Numeric
+from dmon.rates import get_cross_rates, parse_optional_date
+
+
+CURRENCIES: List[Currency] = list(Currency)
+CURRENCY_INDEX = {currency: i for i, currency in enumerate(CURRENCIES)}
+
+# Number of decimal digits kept below the cent.
+DEFAULT_SCALE = 2
+
+CurrencyArg = Union[str, Currency, None]
+DateArg = Union[str, date, None]
+
+
+def _currency_index(currency: CurrencyArg, default: Currency) -> int:
+    return CURRENCY_INDEX[to_currency_enum(currency or default)]
+
+
+def _date_ordinal(on_date: DateArg) -> int:
+    dt = parse_optional_date(on_date)
+    return dt.toordinal() if dt is not None else 0
+
+
+def _column(value, size: int, convert, dtype) -> "np.ndarray":
+    if value is None or isinstance(value, (str, date, Currency)):
+        return np.full(size, convert(value), dtype=dtype)
+    column = np.fromiter((convert(v) for v in value), dtype=dtype, count=size)
+    return column
+
+
+def conversion_factors(
+    ordinals: "np.ndarray", from_index: "np.ndarray", to_index: int
+) -> "np.ndarray":
+    """Returns the float64 factors that convert amounts in the
+    currencies `from_index`, with the rates of the dates `ordinals`
+    (which must not contain 0), to the currency `to_index`. Each factor
+    is the one of the `CrossRates` of the date, computed once per pair
+    of currencies."""
+    n_currencies = len(CURRENCIES)
+    keys, inverse = np.unique(
+        ordinals.astype(np.int64) * n_currencies + from_index, return_inverse=True
+    )
+    to_currency = CURRENCIES[to_index]
+    factors = np.empty(len(keys))
+    missing = set()
+    cross_rates, rates_ordinal = None, 0
+    for i, key in enumerate(keys):
+        ordinal, index = divmod(int(key), n_currencies)
+        if ordinal != rates_ordinal:
+            rates_date = date.fromordinal(ordinal)
+            cross_rates, rates_ordinal = get_cross_rates(rates_date), ordinal
+            if cross_rates is None:
+                raise RuntimeError(f"Could not find rates for {rates_date}")
+        from_currency = CURRENCIES[index]
+        if from_currency in cross_rates.rates and to_currency in cross_rates.rates:
+            factors[i] = float(cross_rates.factor(from_currency, to_currency))
+        else:
+            missing.add(from_currency)
+    if missing:
+        raise RuntimeError(f"Could not find conversion rates for {missing}")
+    return factors[inverse]
+
+
+class MoneyArray:
+    """An array of amounts, each one with its own currency and date.
+
+    Arguments:
+
+    - amounts: The amounts, in units of their currency (not cents).
+
+    - currencies: A single currency for all the amounts, or one per
+                  amount. Defaults to the base currency of
+                  `money_class`.
+
+    - dates: A single date for all the amounts, or one per amount
+             (each one can be None).
+
+    - money_class: The class, as returned by `dmon.Money`, whose base
+                   currency and base date are used for operations, and
+                   whose instances are returned by `sum` and item
+                   access.
+
+    - scale: Number of decimal digits kept below the cent.
+    """
+
+    __slots__ = ("units", "currency_index", "date_ordinals", "money_class", "scale")
+
+    def __init__(
+        self,
+        amounts: Iterable[Numeric],
+        currencies: Union[CurrencyArg, Sequence[CurrencyArg]] = None,
+        dates: Union[DateArg, Sequence[DateArg]] = None,
+        money_class: Type[BaseMoney] = BaseMoney,
+        scale: int = DEFAULT_SCALE,
+    ) -> None:
+        values = np.asarray(
+            [float(a) for a in amounts] if not isinstance(amounts, np.ndarray) else amounts,
+            dtype=np.float64,
+        )
+        base = to_currency_enum(money_class.base_currency)
+        self.units = np.rint(values * 10 ** (scale + 2)).astype(np.int64)
+        self.currency_index = _column(
+            currencies, len(values), lambda c: _currency_index(c, base), np.int16
+        )
+        self.date_ordinals = _column(dates, len(values), _date_ordinal, np.int32)
+        self.money_class = money_class
+        self.scale = scale
+
+    @classmethod
+    def from_parts(
+        cls,
+        units: "np.ndarray",
+        currency_index: "np.ndarray",
+        date_ordinals: "np.ndarray",
+        money_class: Type[BaseMoney] = BaseMoney,
+        scale: int = DEFAULT_SCALE,
+    ) -> "MoneyArray":
+        """Builds an array directly from its columns, without copying
+        or converting them."""
+        array = cls.__new__(cls)
+        array.units = units
+        array.currency_index = currency_index
+        array.date_ordinals = date_ordinals
+        array.money_class = money_class
+        array.scale = scale
+        return array
+
+    @classmethod
+    def from_money(
+        cls,
+        items: Sequence[BaseMoney],
+        money_class: Optional[Type[BaseMoney]] = None,
+        scale: int = DEFAULT_SCALE,
+    ) -> "MoneyArray":
+        """Builds an array from `BaseMoney` instances, exactly up to the
+        array's scale. The money class defaults to the class of the
+        first item."""
+        if money_class is None:
+            money_class = type(items[0]) if len(items) else BaseMoney
+        size = len(items)
+        quantum = Decimal(10) ** scale
+        return cls.from_parts(
+            np.fromiter(
+                (int((m.cents() * quantum).to_integral_value()) for m in items),
+                dtype=np.int64,
+                count=size,
+            ),
+            np.fromiter((CURRENCY_INDEX[m.currency] for m in items), dtype=np.int16, count=size),
+            np.fromiter((_date_ordinal(m.on_date) for m in items), dtype=np.int32, count=size),
+            money_class,
+            scale,
+        )
+
+    def __len__(self) -> int:
+        return len(self.units)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            ordinal = int(self.date_ordinals[key])
+            return self.money_class._make(
+                self.money_class._store(self._units_to_cents(int(self.units[key]))),
+                CURRENCIES[self.currency_index[key]],
+                date.fromordinal(ordinal) if ordinal else None,
+            )
+        return self._with(self.units[key], self.currency_index[key], self.date_ordinals[key])
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({list(self)!r})"
+
+    def to_money(self) -> List[BaseMoney]:
+        return list(self)
+
+    def cents(self, in_currency: Optional[Union[str, Currency]] = None) -> "np.ndarray":
+        """Returns the amounts in cents, as float64, converted to
+        `in_currency` if given."""
+        units = self.units
+        if in_currency is not None:
+            units = self._converted_units(_currency_index(in_currency, Currency.USD))
+        return units / 10**self.scale
+
+    def to(self, currency: Union[str, Currency]) -> "MoneyArray":
+        """Converts all the amounts to `currency`, keeping their dates."""
+        index = _currency_index(currency, Currency.USD)
+        return self._with(
+            self._converted_units(index),
+            np.full(len(self), index, dtype=np.int16),
+            self.date_ordinals,
+        )
+
+    def sum(self) -> BaseMoney:
+        """Returns the sum of the amounts in the base currency, as an
+        instance of the money class."""
+        total = int(self._converted_units(self._base_index()).sum())
+        return self.money_class._make(
+            self.money_class._store(self._units_to_cents(total)),
+            to_currency_enum(self.money_class.base_currency),
+            self.money_class.base_date,
+        )
+
+    def __neg__(self) -> "MoneyArray":
+        return self._with(-self.units, self.currency_index, self.date_ordinals)
+
+    def __add__(self, o: Union["MoneyArray", BaseMoney, Numeric]) -> "MoneyArray":
+        return self._combine(o, np.add)
+
+    __radd__ = __add__
+
+    def __sub__(self, o: Union["MoneyArray", BaseMoney, Numeric]) -> "MoneyArray":
+        return self._combine(o, np.subtract)
+
+    def __rsub__(self, o: Union["MoneyArray", BaseMoney, Numeric]) -> "MoneyArray":
+        return -self + o
+
+    def __mul__(self, n: Union[Numeric, "np.ndarray"]) -> "MoneyArray":
+        factor = np.asarray(n, dtype=np.float64)
+        return self._with(
+            np.rint(self.units * factor).astype(np.int64),
+            self.currency_index,
+            self.date_ordinals,
+        )
+
+    __rmul__ = __mul__
+
+    def __eq__(self, o: object) -> "np.ndarray":  # type: ignore[override]
+        if not isinstance(o, (MoneyArray, BaseMoney)):
+            return NotImplemented
+        v1, v2 = self._normalized_units(o)
+        return self._quantized(v1) == self._quantized(v2)
+
+    def __ne__(self, o: object) -> "np.ndarray":  # type: ignore[override]
+        eq_result = self.__eq__(o)
+        if eq_result is NotImplemented:
+            return NotImplemented
+        return ~eq_result
+
+    def __gt__(self, o: Union["MoneyArray", BaseMoney]) -> "np.ndarray":
+        v1, v2 = self._normalized_units(o)
+        return v1 > v2
+
+    def __ge__(self, o: Union["MoneyArray", BaseMoney]) -> "np.ndarray":
+        return self.__eq__(o) | self.__gt__(o)
+
+    def __lt__(self, o: Union["MoneyArray", BaseMoney]) -> "np.ndarray":
+        v1, v2 = self._normalized_units(o)
+        return v1 < v2
+
+    def __le__(self, o: Union["MoneyArray", BaseMoney]) -> "np.ndarray":
+        return self.__eq__(o) | self.__lt__(o)
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def _with(
+        self, units: "np.ndarray", currency_index: "np.ndarray", date_ordinals: "np.ndarray"
+    ) -> "MoneyArray":
+        return self.from_parts(units, currency_index, date_ordinals, self.money_class, self.scale)
+
+    def _units_to_cents(self, units: int) -> Decimal:
+        return Decimal(units).scaleb(-self.scale)
+
+    def _base_index(self) -> int:
+        return _currency_index(self.money_class.base_currency, Currency.USD)
+
+    def _rates_ordinals(self) -> "np.ndarray":
+        """The ordinal of the date whose rates convert each amount: its
+        own date, or else the base date of the class, or else today."""
+        fallback = self.money_class.base_date or date.today()
+        return np.where(self.date_ordinals != 0, self.date_ordinals, fallback.toordinal())
+
+    def _converted_units(self, to_index: int) -> "np.ndarray":
+        same = self.currency_index == to_index
+        if same.all():
+            return self.units
+
+        factors = conversion_factors(
+            self._rates_ordinals()[~same], self.currency_index[~same], to_index
+        )
+        units = self.units.copy()
+        units[~same] = np.rint(self.units[~same] * factors).astype(np.int64)
+        return units
+
+    def _coerce(self, o: Union["MoneyArray", BaseMoney, Numeric]) -> "MoneyArray":
+        if isinstance(o, MoneyArray):
+            if o.scale != self.scale:
+                raise ValueError("Cannot operate on arrays with different scales")
+            return o
+        if isinstance(o, BaseMoney):
+            return MoneyArray.from_money([o], self.money_class, self.scale)
+        # Plain numbers are in the currency of each element, as in BaseMoney.
+        return self._with(
+            np.full(len(self), round(Decimal(o) * 10 ** (self.scale + 2)), dtype=np.int64),
+            self.currency_index,
+            np.zeros(len(self), dtype=np.int32),
+        )
+
+    def _normalized_units(self, o: Union["MoneyArray", BaseMoney, Numeric]):
+        """Returns the two operands' units in the base currency."""
+        base_index = self._base_index()
+        return self._converted_units(base_index), self._coerce(o)._converted_units(base_index)
+
+    def _combine(self, o: Union["MoneyArray", BaseMoney, Numeric], op) -> "MoneyArray":
+        """Adds or subtracts element-wise as `BaseMoney` does: elements
+        that share currency and conversion date are operated on
+        directly and keep their currency, the others are converted to
+        the base currency."""
+        o = self._coerce(o)
+        size = max(len(self), len(o))
+        base_index = self._base_index()
+        currency_index = np.broadcast_to(self.currency_index, size)
+        shared = (currency_index == o.currency_index) & (
+            (currency_index == base_index) | (self._rates_ordinals() == o._rates_ordinals())
+        )
+
+        if shared.all():
+            units = op(self.units, o.units)
+        else:
+            v1, v2 = self._normalized_units(o)
+            units = np.where(shared, op(self.units, o.units), op(v1, v2))
+
+        base_ordinal = _date_ordinal(self.money_class.base_date)
+        own_date = shared & (currency_index != base_index) & (self.date_ordinals != 0)
+        return self._with(
+            np.broadcast_to(units, size).copy(),
+            np.where(shared, currency_index, base_index).astype(np.int16),
+            np.where(own_date, self.date_ordinals, base_ordinal).astype(np.int32),
+        )
+
+    def _quantized(self, units: "np.ndarray") -> "np.ndarray":
+        """Rounds the units half-up to the precision of the money
+        class, as in `BaseMoney.__eq__`."""
+        quantum = 10 ** max(self.scale - self.money_class.precision, 0)
+        return np.sign(units) * ((np.abs(units) + quantum // 2) // quantum)
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+"""Streaming parsers of monetary values in bulk.
+
+They read records one at a time from any iterable, like an open file,
+so that exports of any size are parsed in constant memory:
+
+- `parse_records` reads records in the format of `BaseMoney.parse`,
+  "yyyy-mm-dd CUR 12.34" or "CUR 12.34";
+
+- `parse_csv` reads the amount, currency and date from columns of CSV
+  rows.
+
+Dates and currencies are looked up once per distinct string. Both
+yield instances of the money class or, with `batch_size`, columnar
+`dmon.array.MoneyArray` batches of up to `batch_size` amounts, which
+require NumPy.
+"""
+
+import csv
+from array import array
+from datetime import date
+from decimal import Decimal
+from functools import lru_cache
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional, Tuple, Type, Union
+
+from dmon.currency import Currency, to_currency_enum
+from dmon.money import BaseMoney, _Cents
+from dmon.rates import parse_date
+
+if TYPE_CHECKING:  # pragma: no cover
+    from dmon.array import MoneyArray
+
+# (amount, currency, date) as strings; the currency and date may be empty.
+Fields = Tuple[str, Optional[str], Optional[str]]
+
+Column = Union[str, int]
+
+
+def parse_records(
+    records: Iterable[str],
+    money_class: Type[BaseMoney] = BaseMoney,
+    batch_size: Optional[int] = None,
+) -> Iterator:
+    """Parses records like those of `BaseMoney.parse`, one per item of
+    `records`, skipping blank ones. Raises a RuntimeError on records
+    that cannot be interpreted."""
+
+    def fields() -> Iterator[Fields]:
+        for number, record in enumerate(records, 1):
+            components = record.split()
+            if len(components) == 3:
+                yield components[2], components[1], components[0]
+            elif len(components) == 2:
+                yield components[1], components[0], None
+            elif components:
+                raise RuntimeError(f"Cannot interpret record {number} for parsing: {record!r}")
+
+    return _parse(fields(), money_class, batch_size)
+
+
+def parse_csv(
+    lines: Iterable[str],
+    amount: Column = "amount",
+    currency: Optional[Column] = "currency",
+    on_date: Optional[Column] = "date",
+    money_class: Type[BaseMoney] = BaseMoney,
+    batch_size: Optional[int] = None,
+    **reader_options,
+) -> Iterator:
+    """Parses the amounts in CSV `lines`, with `csv.reader` and
+    `reader_options`.
+
+    The amount, currency and date columns are given by their names in
+    the header, the first row, or else by their positions (and then
+    there is no header). Amounts are in units of their currency, or in
+    cents if they end with 'c'. Without a currency column, or when it
+    is empty, the base currency of `money_class` is used; without a
+    date column, or when it is empty, amounts have no date.
+    """
+    rows = csv.reader(lines, **reader_options)
+    columns = (amount, currency, on_date)
+    if any(isinstance(c, str) for c in columns):
+        header = next(rows, [])
+        try:
+            columns = tuple(header.index(c) if isinstance(c, str) else c for c in columns)
+        except ValueError as e:
+            raise RuntimeError(f"Missing column in the CSV header: {e}") from None
+    i_amount, i_currency, i_date = columns
+
+    def fields() -> Iterator[Fields]:
+        for row in rows:
+            if row:
+                yield (
+                    row[i_amount],
+                    row[i_currency] if i_currency is not None else None,
+                    row[i_date] if i_date is not None else None,
+                )
+
+    return _parse(fields(), money_class, batch_size)
+
+
+@lru_cache(maxsize=4096)
+def _date(text: str) -> date:
+    return parse_date(text)
+
+
+@lru_cache(maxsize=1024)
+def _currency(text: str) -> Currency:
+    return to_currency_enum(text)
+
+
+def _cents(amount: str) -> Decimal:
+    """Like `BaseMoney.__init__`: '2355c' are cents, '23.55' units."""
+    if amount[-1] == _Cents:
+        return Decimal(amount[:-1])
+    return Decimal(amount) * 100
+
+
+def _parse(
+    fields: Iterator[Fields], money_class: Type[BaseMoney], batch_size: Optional[int]
+) -> Iterator:
+    if batch_size is not None:
+        return _parse_batches(fields, money_class, batch_size)
+    return _parse_money(fields, money_class)
+
+
+def _parse_money(fields: Iterator[Fields], money_class: Type[BaseMoney]) -> Iterator[BaseMoney]:
+    base = to_currency_enum(money_class.base_currency)
+    make, store = money_class._make, money_class._store
+    for amount, currency, on_date in fields:
+        yield make(
+            store(_cents(amount)),
+            _currency(currency) if currency else base,
+            _date(on_date) if on_date else None,
+        )
+
+
+def _parse_batches(
+    fields: Iterator[Fields], money_class: Type[BaseMoney], batch_size: int
+) -> Iterator["MoneyArray"]:
+    import numpy as np
+
+    from dmon.array import CURRENCY_INDEX, DEFAULT_SCALE, MoneyArray
+
+    base = CURRENCY_INDEX[to_currency_enum(money_class.base_currency)]
+    while True:
+        units, currencies, ordinals = array("q"), array("h"), array("i")
+        for amount, currency, on_date in fields:
+            units.append(int(_cents(amount).scaleb(DEFAULT_SCALE).to_integral_value()))
+            currencies.append(CURRENCY_INDEX[_currency(currency)] if currency else base)
+            ordinals.append(_date(on_date).toordinal() if on_date else 0)
+            if len(units) == batch_size:
+                break
+        if not units:
+            return
+        yield MoneyArray.from_parts(
+            np.frombuffer(units, dtype=np.int64),
+            np.frombuffer(currencies, dtype=np.int16),
+            np.frombuffer(ordinals, dtype=np.int32),
+            money_class,
+            DEFAULT_SCALE,
+        )
+        if len(units) < batch_size:
+            return
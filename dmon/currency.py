@@ -339,6 +339,9 @@ ReverseCurrencySymbols["A$"] = Currency.AUD
 ReverseCurrencySymbols["$"] = Currency.USD
 ReverseCurrencySymbols["£"] = Currency.GBP
 
+# The currencies by their lowercase code.
+CURRENCY_CODES = {currency.value: currency for currency in Currency}
+
 
 def to_currency_enum(currency: Union[str, Currency]) -> Currency:
     if isinstance(currency, Currency):
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+"""Instrumentation of the rates lookups.
+
+Disabled by default, when the instrumented code only checks the
+`ENABLED` flag. Once enabled, with `enable()` or with the environment
+variable DMON_METRICS=1, it records:
+
+- counters, like the hits and misses of the in-process rates cache
+  (`rates.cache.hit`, `rates.cache.miss`) and the lookups that each
+  rate source answers (`source.repo.found`, ...);
+
+- histograms of latencies in seconds, like those of the rate sources
+  (`source.repo`, `source.supabase`, `source.api`), of `git pull`
+  (`repo.pull`) and of the queries to the cache database (`db.*`);
+
+- the histogram of the number of days that `find_rates_for_date`
+  walks back to find rates (`fallback.depth`).
+
+`snapshot()` returns all of them as a dict. Exporters added with
+`add_exporter` are called with each event as it is recorded, as
+`exporter(kind, name, value)` with kind "counter" or "histogram".
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Sequence
+
+# Upper bounds of the buckets of the histograms; the last bucket has
+# the values above all of them.
+LATENCY_BUCKETS: Sequence[float] = (
+    0.0001,
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1.0,
+    5.0,
+)
+DEPTH_BUCKETS: Sequence[float] = tuple(range(11))
+
+Exporter = Callable[[str, str, float], None]
+
+ENABLED = os.environ.get("DMON_METRICS", "") not in ("", "0")
+
+
+class Histogram:
+    """Counts of the observed values in fixed buckets, with their sum."""
+
+    __slots__ = ("bounds", "counts", "count", "sum", "max")
+
+    def __init__(self, bounds: Sequence[float]) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def as_dict(self) -> Dict[str, Any]:
+        buckets = {str(bound): count for bound, count in zip(self.bounds, self.counts)}
+        buckets["inf"] = self.counts[-1]
+        return {"count": self.count, "sum": self.sum, "max": self.max, "buckets": buckets}
+
+
+class Metrics:
+    """Counters and histograms, safe to update from several threads."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {}
+        self.histograms: Dict[str, Histogram] = {}
+        self.exporters: List[Exporter] = []
+
+    def increment(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+        for exporter in self.exporters:
+            exporter("counter", name, n)
+
+    def observe(self, name: str, value: float, bounds: Sequence[float] = LATENCY_BUCKETS) -> None:
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(bounds)
+            histogram.observe(value)
+        for exporter in self.exporters:
+            exporter("histogram", name, value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "histograms": {name: h.as_dict() for name, h in self.histograms.items()},
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+METRICS = Metrics()
+
+
+def enable(enabled: bool = True) -> None:
+    """Starts, or with False stops, recording metrics."""
+    global ENABLED
+    ENABLED = enabled
+
+
+def increment(name: str, n: int = 1) -> None:
+    if ENABLED:
+        METRICS.increment(name, n)
+
+
+def observe(name: str, value: float, bounds: Sequence[float] = LATENCY_BUCKETS) -> None:
+    if ENABLED:
+        METRICS.observe(name, value, bounds)
+
+
+@contextmanager
+def _timed(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        METRICS.observe(name, time.perf_counter() - start)
+
+
+_NOT_TIMED = nullcontext()
+
+
+def timer(name: str) -> ContextManager[None]:
+    """Context manager that records how long its block takes in the
+    histogram `name`."""
+    return _timed(name) if ENABLED else _NOT_TIMED
+
+
+def snapshot() -> Dict[str, Any]:
+    """Returns the counters and histograms recorded so far."""
+    return METRICS.snapshot()
+
+
+def reset() -> None:
+    METRICS.reset()
+
+
+def add_exporter(exporter: Exporter) -> None:
+    """Calls `exporter(kind, name, value)` with every event recorded."""
+    METRICS.exporters = METRICS.exporters + [exporter]
+
+
+def remove_exporter(exporter: Exporter) -> None:
+    METRICS.exporters = [e for e in METRICS.exporters if e is not exporter]
@@ -3,10 +3,16 @@
 from datetime import date
 from decimal import Decimal, ROUND_HALF_UP
 from datetime import date
-from typing import Tuple, Union, Optional, ClassVar, Any, Type
+from typing import Tuple, Union, Optional, ClassVar, Any, Type, Dict, Iterable, List
 
 from dmon.currency import Currency, CurrencySymbols, to_currency_enum
-from dmon.rates import get_rates, parse_optional_date, format_date
+from dmon.rates import (
+    CURRENCY_CODES,
+    CrossRates,
+    get_cross_rates,
+    parse_optional_date,
+    format_date,
+)
 
 
 Numeric = Union[int, float, Decimal]
@@ -19,6 +25,8 @@ def cents_str(cents: Union[Numeric, str]) -> str:
 
 
 class BaseMoney:
+    __slots__ = ("_cents", "currency", "on_date")
+
     base_date: ClassVar[Optional[date]] = None
     base_currency: ClassVar[Currency] = Currency.USD
     output_currency: Optional[Currency] = None
@@ -27,6 +35,10 @@ class BaseMoney:
     # equivalent to rounding cents.
     precision: ClassVar[int] = 0
 
+    # Decimals below the cent kept by the integer backend (see
+    # `FixedMoney`), or None for the default Decimal cents.
+    scale: ClassVar[Optional[int]] = None
+
     def __init__(
         self,
         amount: Union[str, Numeric],
@@ -58,6 +70,28 @@ class BaseMoney:
         self.currency: Currency = to_currency_enum(currency or self.__class__.base_currency)
         self.on_date: Optional[date] = parse_optional_date(on_date)
 
+    @classmethod
+    def _make(cls, cents: Decimal, currency: Currency, on_date: Optional[date]) -> "BaseMoney":
+        """Builds an instance from already normalized values: the amount
+        in cents, the currency as an enum and the date as a date (or
+        None), skipping the parsing done in `__init__`."""
+        self = object.__new__(cls)
+        self._cents = cents
+        self.currency = currency
+        self.on_date = on_date
+        return self
+
+    @classmethod
+    def _round(cls, value: Decimal) -> Decimal:
+        """Rounds a computed value to the internal representation of
+        the amounts. Decimal cents are kept as they are."""
+        return value
+
+    @classmethod
+    def _store(cls, cents: Decimal) -> Decimal:
+        """Converts an amount in cents to the internal representation."""
+        return cents
+
     def cents(self, in_currency: Optional[Union[str, Currency]] = None) -> Decimal:
         """Converts the money amount to cents in the specified
         currency on the given date.
@@ -82,26 +116,26 @@ class BaseMoney:
 
         The amount is then converted to cents in the target currency
         by multiplying it with the ratio of the target currency rate
-        to the original currency rate.
+        to the original currency rate, taken from the cached
+        `CrossRates` of the date.
 
         """
-        currency = to_currency_enum(in_currency or self.currency)
+        return self._cents_in(to_currency_enum(in_currency or self.currency))
+
+    def _cents_in(self, currency: Currency) -> Decimal:
+        """Returns the amount in `currency` in the internal
+        representation."""
         if currency == self.currency:
             return self._cents
+        return self._convert(_cross_rates(self.rates_date()), currency)
 
-        rates_date = self.on_date or self.base_date or date.today()
-        rates = get_rates(rates_date, currency, self.currency)
+    def _convert(self, cross_rates: CrossRates, currency: Currency) -> Decimal:
+        return self._round(cross_rates.convert(self._cents, self.currency, currency))
 
-        if rates is None:
-            raise RuntimeError("Could not find rates for {rates_date}")
-
-        if rates[currency] is None:
-            raise RuntimeError("Could not find conversion rate for ", currency)
-
-        if rates[self.currency] is None:
-            raise RuntimeError("Could not find conversion rate for ", self.currency)
-
-        return self._cents * Decimal(str(rates[currency])) / Decimal(str(rates[self.currency]))
+    def rates_date(self) -> date:
+        """Returns the date whose rates convert this amount: its own
+        date, or else the base date of its class, or else today."""
+        return self.on_date or self.base_date or date.today()
 
     def amount(
         self, currency: Optional[Union[str, Currency]] = None, rounding: bool = False
@@ -110,59 +144,112 @@ class BaseMoney:
         return (Decimal(round(cents)) if rounding else cents) / Decimal("100")
 
     def to(self, currency: Union[str, Currency]) -> "BaseMoney":
-        return self.__class__(cents_str(self.cents(currency)), currency, on_date=self.on_date)
+        currency = to_currency_enum(currency)
+        return self._make(self._cents_in(currency), currency, self.on_date)
 
-    def on(self, on_date: str) -> "BaseMoney":
-        return self.__class__(cents_str(self._cents), self.currency, on_date=on_date)
+    def on(self, on_date: Union[date, str]) -> "BaseMoney":
+        return self._make(self._cents, self.currency, parse_optional_date(on_date))
 
     def normalized_amounts(self, o: "BaseMoney") -> Tuple[Decimal, Decimal]:
-        """Returns the two amounts in the base currency."""
-        return (self.cents(self.base_currency), o.cents(self.base_currency))
+        """Returns the two amounts in the base currency. Amounts already
+        in the base currency are not converted, and when both need to
+        be converted on the same date the rates are fetched once."""
+        base = to_currency_enum(self.base_currency)
+        if self.scale != o.scale:
+            # Amounts of different backends, in the representation of self.
+            return self._cents_in(base), self._store(o.cents(base))
+        if self.currency == base and o.currency == base:
+            return self._cents, o._cents
+
+        rates_date = self.rates_date()
+        if self.currency == base or o.currency == base or rates_date != o.rates_date():
+            return self._cents_in(base), o._cents_in(base)
+
+        cross_rates = _cross_rates(rates_date)
+        return self._convert(cross_rates, base), o._convert(cross_rates, base)
+
+    def _shares_currency(self, o: "BaseMoney") -> bool:
+        """Whether the two amounts can be operated on without
+        conversions: they have the same currency and backend and,
+        unless it is the base currency, are converted on the same
+        date."""
+        return (
+            o.currency == self.currency
+            and o.scale == self.scale
+            and (
+                self.currency == to_currency_enum(self.base_currency)
+                or self.rates_date() == o.rates_date()
+            )
+        )
+
+    def _combine(self, cents: Decimal) -> "BaseMoney":
+        """Builds the result of adding or subtracting two amounts that
+        share currency and date (see `_shares_currency`), given its
+        amount in cents in their currency."""
+        if self.currency == to_currency_enum(self.base_currency):
+            return self._make(cents, self.currency, self.base_date)
+        return self._make(cents, self.currency, self.on_date or self.base_date)
 
     def __neg__(self) -> "BaseMoney":
-        return self.__class__(cents_str(-self._cents), self.currency, on_date=self.on_date)
+        return self._make(-self._cents, self.currency, self.on_date)
 
     def __add__(self, o: Union["BaseMoney", Numeric, str]) -> "BaseMoney":
+        """Adds two amounts.
+
+        If both are in the same currency and are converted on the same
+        date their cents are added directly, and the result keeps the
+        currency and date. Otherwise both are converted to the base
+        currency, and the result is in the base currency on the base
+        date. In both cases the result has the same value, but the
+        first one is exact.
+        """
         if not isinstance(o, BaseMoney):
             o = self.__class__(o, self.currency)
 
+        if self._shares_currency(o):
+            return self._combine(self._cents + o._cents)
+
         v1, v2 = self.normalized_amounts(o)
-        return self.__class__(cents_str(v1 + v2), self.base_currency, on_date=self.base_date)
+        return self._make(v1 + v2, to_currency_enum(self.base_currency), self.base_date)
 
     def __radd__(self, o: Union["BaseMoney", Numeric, str]) -> "BaseMoney":
         return self + o
 
     def __sub__(self, o: Union["BaseMoney", Numeric, str]) -> "BaseMoney":
+        """Subtracts two amounts, with the same rules as `__add__`."""
         if not isinstance(o, BaseMoney):
             o = self.__class__(o, self.currency)
 
+        if self._shares_currency(o):
+            return self._combine(self._cents - o._cents)
+
         v1, v2 = self.normalized_amounts(o)
-        return self.__class__(cents_str(v1 - v2), self.base_currency, on_date=self.base_date)
+        return self._make(v1 - v2, to_currency_enum(self.base_currency), self.base_date)
 
     def __rsub__(self, o: Union["BaseMoney", Numeric, str]) -> "BaseMoney":
         return -self + o
 
     def __mul__(self, n: Numeric) -> "BaseMoney":
-        return self.__class__(
-            cents_str(self._cents * Decimal(n)), self.currency, on_date=self.on_date
-        )
+        return self._make(self._round(self._cents * Decimal(n)), self.currency, self.on_date)
 
     __rmul__ = __mul__
 
     def __truediv__(self, o: Union["BaseMoney", Numeric]) -> Union["BaseMoney", Decimal]:
         if isinstance(o, BaseMoney):
             v1, v2 = self.normalized_amounts(o)
-            return v1 / v2
+            return Decimal(v1) / Decimal(v2)
             # return self._cents / n.to(self.currency).cents()
 
-        return self.__class__(
-            cents_str(self._cents / Decimal(o)), self.currency, on_date=self.on_date
-        )
+        return self._make(self._round(self._cents / Decimal(o)), self.currency, self.on_date)
 
     def __eq__(self, o: object) -> bool:
+        """Two amounts are equal if they are the same in the base
+        currency once rounded to `precision` decimals of the cents."""
         if not isinstance(o, BaseMoney):
             return NotImplemented
-        v1, v2 = self.normalized_amounts(o)
+        return self._normalized_eq(*self.normalized_amounts(o))
+
+    def _normalized_eq(self, v1: Decimal, v2: Decimal) -> bool:
         precision_decimal = Decimal("1").scaleb(-self.precision)
         v1_quantized = v1.quantize(precision_decimal, rounding=ROUND_HALF_UP)
         v2_quantized = v2.quantize(precision_decimal, rounding=ROUND_HALF_UP)
@@ -174,25 +261,33 @@ class BaseMoney:
             return NotImplemented
         return not eq_result
 
+    def _ordered_amounts(self, o: "BaseMoney") -> Tuple[Decimal, Decimal]:
+        """Returns two amounts that are ordered as the two amounts in
+        the base currency: their own cents if they share currency and
+        date, since the conversion preserves the order."""
+        if self._shares_currency(o):
+            return self._cents, o._cents
+        return self.normalized_amounts(o)
+
     def __gt__(self, o: "BaseMoney") -> bool:
-        v1, v2 = self.normalized_amounts(o)
+        v1, v2 = self._ordered_amounts(o)
         return v1 > v2
 
     def __ge__(self, o: "BaseMoney") -> bool:
-        eq_result = self.__eq__(o)
-        if eq_result is NotImplemented:
+        if not isinstance(o, BaseMoney):
             return NotImplemented
-        return eq_result or self.__gt__(o)
+        v1, v2 = self.normalized_amounts(o)
+        return v1 > v2 or self._normalized_eq(v1, v2)
 
     def __lt__(self, o: "BaseMoney") -> bool:
-        v1, v2 = self.normalized_amounts(o)
+        v1, v2 = self._ordered_amounts(o)
         return v1 < v2
 
     def __le__(self, o: "BaseMoney") -> bool:
-        eq_result = self.__eq__(o)
-        if eq_result is NotImplemented:
+        if not isinstance(o, BaseMoney):
             return NotImplemented
-        return eq_result or self.__lt__(o)
+        v1, v2 = self.normalized_amounts(o)
+        return v1 < v2 or self._normalized_eq(v1, v2)
 
     def __str__(self) -> str:
         currency = self.output_currency or self.currency
@@ -211,8 +306,9 @@ class BaseMoney:
 
         https://docs.python.org/3/library/sqlite3.html#how-to-write-adaptable-objects
 
-        Will also need the inverse (string to Money_*) to be registered with
-        register_converter.
+        The amounts are written as their repr, unless their class is
+        registered with `register_sqlite`, which writes them with the
+        compact encoding of `encode` and reads both back.
         """
         import sqlite3
 
@@ -220,6 +316,30 @@ class BaseMoney:
             return repr(self)
         return None
 
+    def encode(self) -> str:
+        """Returns a compact and lossless encoding of the amount, as
+        'currency:date ordinal:cents', with a 0 ordinal if there is no
+        date. It is read back with `decode`."""
+        return "%s:%d:%s" % (
+            self.currency.value,
+            self.on_date.toordinal() if self.on_date is not None else 0,
+            self.cents(),
+        )
+
+    @classmethod
+    def decode(cls, value: Union[bytes, str]) -> "BaseMoney":
+        """Builds an amount from the result of `encode`, or of `repr`."""
+        if isinstance(value, bytes):
+            value = value.decode("ascii")
+        if ":" not in value:
+            return cls.parse(value)
+        code, ordinal, cents = value.split(":")
+        return cls._make(
+            cls._store(Decimal(cents)),
+            CURRENCY_CODES[code],
+            date.fromordinal(int(ordinal)) if ordinal != "0" else None,
+        )
+
     @classmethod
     def parse(cls, string: str) -> "BaseMoney":
         components = string.split(" ")
@@ -234,19 +354,190 @@ class BaseMoney:
         return cls(amount, currency, on_date)
 
 
+class FixedMoney(BaseMoney):
+    """Integer fixed-point backend of BaseMoney, created with
+    `Money(..., backend="int")`.
+
+    The amounts are stored as Python ints, in units of 10**-scale
+    cents, so that sums and comparisons of many amounts do not go
+    through Decimal. Values that are not exact in those units, like
+    the results of conversions, multiplications and divisions, are
+    rounded with `rounding` when they are computed, and the results
+    are therefore deterministic. `cents()` and `amount()` still return
+    Decimals.
+    """
+
+    __slots__ = ()
+
+    scale: ClassVar[int] = 4
+    rounding: ClassVar[str] = ROUND_HALF_UP
+
+    def __init__(
+        self,
+        amount: Union[str, Numeric],
+        currency: Optional[Union[str, Currency]] = None,
+        on_date: Optional[Union[date, str]] = None,
+    ) -> None:
+        super().__init__(amount, currency, on_date)
+        self._cents = self._store(self._cents)
+
+    @classmethod
+    def _round(cls, value: Decimal) -> int:
+        return int(Decimal(value).to_integral_value(rounding=cls.rounding))
+
+    @classmethod
+    def _store(cls, cents: Decimal) -> int:
+        return cls._round(Decimal(cents).scaleb(cls.scale))
+
+    def cents(self, in_currency: Optional[Union[str, Currency]] = None) -> Decimal:
+        """Returns the amount in cents in `in_currency`, or in its own
+        currency, rounded to `scale` decimals."""
+        units = self._cents_in(to_currency_enum(in_currency or self.currency))
+        return Decimal(units).scaleb(-self.scale)
+
+    def _normalized_eq(self, v1: int, v2: int) -> bool:  # type: ignore[override]
+        quantum = 10 ** max(self.scale - self.precision, 0)
+        return _round_half_up(v1, quantum) == _round_half_up(v2, quantum)
+
+
+def _round_half_up(units: int, quantum: int) -> int:
+    """Divides by `quantum` rounding half away from zero, like
+    ROUND_HALF_UP does for Decimals."""
+    if quantum == 1:
+        return units
+    if units < 0:
+        return -((-units + quantum // 2) // quantum)
+    return (units + quantum // 2) // quantum
+
+
+class Ledger:
+    """Accumulates many amounts, keeping an exact subtotal for each
+    currency and date of conversion rates, and converting each
+    subtotal once when the total is requested.
+
+    Summing a list of amounts with `sum` converts each one to the
+    base currency as it is added. With a ledger the conversions
+    depend only on the number of different currencies and dates:
+
+        ledger = Ledger(Eur)
+        ledger.extend([Eur(10), Eur(20, "usd"), Eur(30, "usd"), Eur(5)])
+        assert ledger.total() == Eur(15) + Eur(50, "usd")
+
+    The amounts are kept in the representation of `money_class`, by
+    default the class of the first amount added.
+    """
+
+    __slots__ = ("money_class", "_subtotals")
+
+    def __init__(
+        self, money_class: Optional[Type[BaseMoney]] = None, items: Iterable[BaseMoney] = ()
+    ) -> None:
+        self.money_class = money_class
+        self._subtotals: Dict[Tuple[Currency, date], Any] = {}
+        self.extend(items)
+
+    def add(self, money: BaseMoney) -> None:
+        if self.money_class is None:
+            self.money_class = type(money)
+        cents = money._cents
+        if money.scale != self.money_class.scale:
+            cents = self.money_class._store(money.cents())
+
+        key = (money.currency, money.rates_date())
+        subtotals = self._subtotals
+        subtotals[key] = subtotals[key] + cents if key in subtotals else cents
+
+    def extend(self, items: Iterable[BaseMoney]) -> None:
+        for money in items:
+            self.add(money)
+
+    def __iadd__(self, o: Union[BaseMoney, "Ledger"]) -> "Ledger":
+        if isinstance(o, Ledger):
+            self.extend(o.subtotals())
+        else:
+            self.add(o)
+        return self
+
+    def __len__(self) -> int:
+        """The number of subtotals, one per currency and date."""
+        return len(self._subtotals)
+
+    def subtotals(self) -> List[BaseMoney]:
+        """Returns the subtotals, as amounts on their dates."""
+        money_class = self.money_class or BaseMoney
+        return [
+            money_class._make(cents, currency, rates_date)
+            for (currency, rates_date), cents in self._subtotals.items()
+        ]
+
+    def total(self, currency: Optional[Union[str, Currency]] = None) -> BaseMoney:
+        """Returns the sum of all the amounts, like adding them would: in
+        the base currency of the money class on its base date, each
+        subtotal converted with the rates of its date. With `currency`
+        the sum is then converted to it."""
+        money_class = self.money_class or BaseMoney
+        base = to_currency_enum(money_class.base_currency)
+        total = money_class._store(Decimal(0))
+        for (from_currency, rates_date), cents in self._subtotals.items():
+            if from_currency != base:
+                cents = money_class._round(
+                    _cross_rates(rates_date).convert(cents, from_currency, base)
+                )
+            total += cents
+
+        result = money_class._make(total, base, money_class.base_date)
+        return result.to(currency) if currency else result
+
+
+def register_sqlite(money_class: Type[BaseMoney], type_name: str = "MONEY") -> None:
+    """Registers with sqlite3 an adapter that writes the instances of
+    `money_class` with `BaseMoney.encode`, and a converter that reads
+    the columns declared as `type_name` as instances of `money_class`,
+    in that encoding or as written by `__conform__`.
+
+    The converter is used by connections opened with
+    `detect_types=sqlite3.PARSE_DECLTYPES`. sqlite3 looks for adapters
+    by the exact type, so each money class must be registered.
+    """
+    import sqlite3
+
+    sqlite3.register_adapter(money_class, money_class.encode)
+    sqlite3.register_converter(type_name, money_class.decode)
+
+
+def _cross_rates(rates_date: date) -> CrossRates:
+    cross_rates = get_cross_rates(rates_date)
+    if cross_rates is None:
+        raise RuntimeError(f"Could not find rates for {rates_date}")
+    return cross_rates
+
+
 def Money(
     base_currency: Union[Currency, str],
     base_date: Optional[Union[date, str]] = None,
     output_currency: Optional[Union[Currency, str]] = None,
     class_name: Optional[str] = "",
+    backend: str = "decimal",
+    scale: int = FixedMoney.scale,
 ) -> Type[BaseMoney]:
-    """Factory that creates a class for computing with a currency on a date."""
+    """Factory that creates a class for computing with a currency on a date.
+
+    With `backend="int"` the amounts of the class are stored as ints
+    with `scale` decimals below the cent (see `FixedMoney`), instead of
+    as Decimal cents.
+    """
+    if backend not in ("decimal", "int"):
+        raise ValueError(f"Unknown money backend {backend!r}")
     c_name = class_name or "Money_" + (
         format_date(base_date) if base_date is not None else "current"
     )
     class_attrs = {
+        "__slots__": (),
         "base_date": parse_optional_date(base_date),
-        "base_currency": base_currency,
+        "base_currency": to_currency_enum(base_currency),
         "output_currency": to_currency_enum(output_currency) if output_currency else None,
     }
+    if backend == "int":
+        class_attrs["scale"] = scale
+        return type(c_name, (FixedMoney,), class_attrs)
     return type(c_name, (BaseMoney,), class_attrs)
@@ -1,23 +1,76 @@
 # -*- coding: utf-8 -*-
 
 import os
+import atexit
 import json
+import math
+import logging
 import threading
 import time
-import subprocess
 import sqlite3
-import requests
+from collections import OrderedDict
 from decimal import Decimal
 from contextlib import contextmanager
-from datetime import datetime, date
-from dateutil.relativedelta import relativedelta
-from typing import Optional, Union, Dict, ClassVar, Tuple
-from dotenv import load_dotenv
-
-load_dotenv()
-
-
-from dmon.currency import Currency
+from datetime import datetime, date, timedelta
+from typing import Optional, Union, Dict, List, Tuple, Mapping, Any, Set, Callable, Iterable
+
+# The network clients (requests, supabase), dotenv and subprocess are
+# imported only when they are used, so that importing dmon stays fast
+# for code that only converts with cached rates.
+
+from dmon import metrics
+from dmon.currency import CURRENCY_CODES, Currency
+from dmon.snapshot import RatesSnapshot, write_snapshot
+
+log = logging.getLogger(__name__)
+
+_ENV_LOADED = False
+
+
+def load_env() -> None:
+    """Loads the variables in the .env file, if any, into the
+    environment. It runs once, the first time the configuration is
+    read: when the cache database is first opened or a rate source is
+    first used. The settings it loads are then applied to the objects
+    that read them on import (see `_apply_env_settings`)."""
+    global _ENV_LOADED
+    if not _ENV_LOADED:
+        from dotenv import load_dotenv
+
+        known = set(os.environ)
+        load_dotenv()
+        _ENV_LOADED = True
+        _apply_env_settings(set(os.environ) - known)
+
+
+def _env_flag(name: str) -> bool:
+    return os.environ.get(name, "") not in ("", "0")
+
+
+def _apply_env_settings(names: Set[str]) -> None:
+    """Applies to the objects configured from the environment when
+    dmon is imported (`RATES_CACHE`, `RATE_RESOLUTIONS`, `REPO_SYNC`,
+    `FETCH_LOCKS`, `TODAY_REFRESHER` and the metrics) the variables in
+    `names`, those that the .env file has set since."""
+    env = os.environ
+    if "DMON_METRICS" in names:
+        metrics.enable(_env_flag("DMON_METRICS"))
+    if "DMON_RATES_MEMORY_CACHE" in names:
+        RATES_CACHE.resize(int(env["DMON_RATES_MEMORY_CACHE"]))
+    if "DMON_MISSING_RATES_TTL" in names:
+        RATE_RESOLUTIONS.missing_ttl = float(env["DMON_MISSING_RATES_TTL"])
+    if "DMON_FALLBACK_RATES_TTL" in names:
+        RATE_RESOLUTIONS.fallback_ttl = float(env["DMON_FALLBACK_RATES_TTL"])
+    if "DMON_RATES_REPO_SYNC_INTERVAL" in names:
+        REPO_SYNC.interval = float(env["DMON_RATES_REPO_SYNC_INTERVAL"])
+    if "DMON_RATES_PROCESS_LOCKS" in names:
+        FETCH_LOCKS.enabled = _env_flag("DMON_RATES_PROCESS_LOCKS")
+    if "DMON_RATES_LOCK_TTL" in names:
+        FETCH_LOCKS.ttl = float(env["DMON_RATES_LOCK_TTL"])
+    if "DMON_TODAY_RATES_REFRESH_INTERVAL" in names:
+        TODAY_REFRESHER.interval = float(env["DMON_TODAY_RATES_REFRESH_INTERVAL"])
+    if "DMON_SERVE_STALE_RATES" in names:
+        TODAY_REFRESHER.serve_stale = _env_flag("DMON_SERVE_STALE_RATES")
 
 
 def parse_date(dt: Union[date, str]) -> date:
@@ -39,105 +92,800 @@ def format_date(dt: Union[date, str]) -> str:
     return as_date.strftime("%Y-%m-%d")
 
 
+def configure_connection(conn: sqlite3.Connection) -> sqlite3.Connection:
+    """Applies the per-connection settings used for the cache database.
+    The WAL journal mode, which is persistent, is set when the tables
+    are created (see `maybe_create_cache_table`)."""
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -8192")
+    conn.execute("PRAGMA mmap_size = 67108864")
+    conn.execute("PRAGMA busy_timeout = 5000")
+    return conn
+
+
 class ConnectionPool:
-    _instance = None
-    _lock = threading.Lock()
-    _db_file: ClassVar[str] = ""
-    _ref_count: ClassVar[int] = 0
-    _connection = None
-
-    def __new__(cls, db_file: str):
-        with cls._lock:
-            if cls._instance is None:
-                cls._instance = super().__new__(cls)
-                cls._db_file = db_file
-        return cls._instance
-
-    @classmethod
-    def get_connection(cls):
-        with cls._lock:
-            if cls._connection is None:
-                cls._connection = sqlite3.connect(cls._db_file)
-                cls._connection.row_factory = sqlite3.Row
-            cls._ref_count += 1
-            return cls._connection
-
-    @classmethod
-    def release_connection(cls):
-        with cls._lock:
-            cls._ref_count -= 1
-            if cls._ref_count == 0 and cls._connection is not None:
-                cls._connection.close()
-                cls._connection = None
-
-
-CONNECTION_POOL = None
+    """Connections to a cache database, kept open for the life of the
+    process: one reader per thread, so that threads can query the
+    database concurrently, and a single writer shared by all threads
+    and serialized by a lock.
+    """
+
+    def __init__(self, db_file: str) -> None:
+        self.db_file = db_file
+        self._local = threading.local()
+        self._readers: Dict[int, sqlite3.Connection] = {}
+        self._lock = threading.Lock()
+        self._writer: Optional[sqlite3.Connection] = None
+        self._write_lock = threading.RLock()
+        # Whether maybe_create_cache_table has already run on this database.
+        self.schema_ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        return configure_connection(sqlite3.connect(self.db_file, check_same_thread=False))
+
+    def reader(self) -> sqlite3.Connection:
+        """Returns the connection of the calling thread."""
+        conn = getattr(self._local, "connection", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.connection = conn
+            with self._lock:
+                # Close the connections of threads that have finished.
+                alive = {thread.ident for thread in threading.enumerate()}
+                alive.discard(threading.get_ident())
+                for ident in [i for i in self._readers if i not in alive]:
+                    self._readers.pop(ident).close()
+                self._readers[threading.get_ident()] = conn
+        return conn
+
+    @contextmanager
+    def writer(self):
+        """Holds the write lock and yields the writer connection,
+        committing when done or rolling back on errors."""
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self._connect()
+            try:
+                yield self._writer
+                self._writer.commit()
+            except BaseException:
+                self._writer.rollback()
+                raise
+
+    def close(self) -> None:
+        with self._write_lock, self._lock:
+            for conn in self._readers.values():
+                conn.close()
+            self._readers.clear()
+            self._local = threading.local()
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+CONNECTION_POOL: Optional[ConnectionPool] = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_connection_pool(database_dir: Optional[str] = None) -> ConnectionPool:
+    """Returns the process-wide pool of connections to the cache
+    database, creating it the first time. The database is
+    exchange-rates.db in `database_dir`, or in the DMON_RATES_CACHE
+    directory, or in the current directory."""
+    global CONNECTION_POOL
+    if CONNECTION_POOL is None:
+        with _POOL_LOCK:
+            if CONNECTION_POOL is None:
+                load_env()
+                ddir = database_dir or os.environ.get("DMON_RATES_CACHE", ".")
+                os.makedirs(ddir, exist_ok=True)
+                CONNECTION_POOL = ConnectionPool(os.path.join(ddir, "exchange-rates.db"))
+    return CONNECTION_POOL
 
 
 @contextmanager
 def get_db_connection(database_dir: Optional[str] = None):
+    """Yields the calling thread's connection to the cache database,
+    for reading."""
+    yield get_connection_pool(database_dir).reader()
+
+
+@contextmanager
+def get_db_writer(database_dir: Optional[str] = None):
+    """Yields the connection used for writing to the cache database,
+    holding the write lock and committing at the end."""
+    with get_connection_pool(database_dir).writer() as conn:
+        yield conn
+
+
+@atexit.register
+def close_db_connections() -> None:
+    """Closes all the connections to the cache database. The next
+    access opens it again, from the DMON_RATES_CACHE directory at the
+    time."""
     global CONNECTION_POOL
-    if CONNECTION_POOL is None:
-        ddir = database_dir or os.environ.get("DMON_RATES_CACHE", ".")
-        os.makedirs(ddir, exist_ok=True)
-        CONNECTION_POOL = ConnectionPool(os.path.join(ddir, "exchange-rates.db"))
+    with _POOL_LOCK:
+        if CONNECTION_POOL is not None:
+            CONNECTION_POOL.close()
+            CONNECTION_POOL = None
+
+
+# The pools inherited from the parent process, kept so that their
+# connections are never closed, nor used, by the child.
+_INHERITED_POOLS: List[ConnectionPool] = []
+
+
+def _forget_db_connections() -> None:
+    """Runs in the child after a fork: SQLite connections must not be
+    used across a fork, so the child opens its own."""
+    global CONNECTION_POOL, _POOL_LOCK
+    if CONNECTION_POOL is not None:
+        _INHERITED_POOLS.append(CONNECTION_POOL)
+    CONNECTION_POOL = None
+    _POOL_LOCK = threading.Lock()
 
-    connection = CONNECTION_POOL.get_connection()
-    try:
-        yield connection
-    finally:
-        CONNECTION_POOL.release_connection()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_db_connections)
+
+
+RatesRow = Dict[Currency, Decimal]
+
+
+class CrossRates:
+    """The rates of one date, ready for converting between any pair of
+    currencies.
+
+    `factor` gives the cross rate of a currency pair, computed the
+    first time the pair is used and kept afterwards; `precompute`
+    builds the whole matrix at once. `convert` is the path used by
+    `BaseMoney`: it multiplies by the target rate and divides by the
+    source rate, in that order, so that the results are identical to
+    the ones computed from `get_rates`. The factors are used where
+    that is not needed, like the conversions of `dmon.array`.
+    """
+
+    __slots__ = ("on_date", "rates", "_factors")
+
+    def __init__(self, on_date: date, rates: RatesRow) -> None:
+        self.on_date = on_date
+        self.rates = rates
+        self._factors: Dict[Tuple[Currency, Currency], Decimal] = {}
+
+    def rate(self, currency: Currency) -> Decimal:
+        rate = self.rates.get(currency)
+        if rate is None:
+            raise RuntimeError(f"Could not find conversion rate for {currency} on {self.on_date}")
+        return rate
+
+    def factor(self, from_currency: Currency, to_currency: Currency) -> Decimal:
+        """Returns the number of `to_currency` units in one unit of
+        `from_currency`."""
+        try:
+            return self._factors[(from_currency, to_currency)]
+        except KeyError:
+            factor = self.rate(to_currency) / self.rate(from_currency)
+            self._factors[(from_currency, to_currency)] = factor
+            return factor
+
+    def precompute(self) -> "CrossRates":
+        """Computes the factors of every pair of known currencies."""
+        for from_currency in self.rates:
+            for to_currency in self.rates:
+                self.factor(from_currency, to_currency)
+        return self
+
+    def convert(self, cents: Decimal, from_currency: Currency, to_currency: Currency) -> Decimal:
+        if from_currency == to_currency:
+            return cents
+        return cents * self.rate(to_currency) / self.rate(from_currency)
+
+
+class RatesCache:
+    """Bounded, thread-safe, in-process LRU of parsed rate rows keyed
+    by date.
+
+    Each entry is the `CrossRates` of a date, holding the full row of
+    rates already converted to Decimal, so that repeated conversions
+    on the same date do not reach the sqlite cache. The least recently used date
+    is evicted once more than `maxsize` dates are held; a `maxsize` of
+    0 disables the cache.
+
+    Pinned dates (see `pin`) are kept apart, and are never evicted nor
+    counted in `maxsize`. Other dates can be put with a `ttl`, after
+    which they are dropped.
+    """
+
+    def __init__(self, maxsize: int = 1024) -> None:
+        self.maxsize = maxsize
+        self._rows: "OrderedDict[date, CrossRates]" = OrderedDict()
+        self._pins: Set[date] = set()
+        self._pinned: Dict[date, CrossRates] = {}
+        self._expiry: Dict[date, float] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._rows) + len(self._pinned)
+
+    def __contains__(self, dt: date) -> bool:
+        return dt in self._rows or dt in self._pinned
+
+    def get(self, dt: date) -> Optional[CrossRates]:
+        with self._lock:
+            row = self._pinned.get(dt)
+            if row is None:
+                row = self._rows.get(dt)
+                if row is not None:
+                    if self._expiry and self._expiry.get(dt, math.inf) <= time.monotonic():
+                        del self._rows[dt], self._expiry[dt]
+                        return None
+                    self._rows.move_to_end(dt)
+            return row
+
+    def put(self, dt: date, row: CrossRates, ttl: Optional[float] = None) -> None:
+        """Keeps the rates of `dt`, for `ttl` seconds if given."""
+        with self._lock:
+            if dt in self._pins:
+                self._pinned[dt] = row
+                return
+            if self.maxsize <= 0:
+                return
+            self._rows[dt] = row
+            self._rows.move_to_end(dt)
+            if ttl is not None:
+                self._expiry[dt] = time.monotonic() + ttl
+            else:
+                self._expiry.pop(dt, None)
+            self._evict()
+
+    def pin(self, dt: date, row: CrossRates) -> None:
+        """Keeps the rates of `dt` until `unpin` or `clear`. If they are
+        discarded, the next rates put for the date are pinned again."""
+        with self._lock:
+            self._rows.pop(dt, None)
+            self._expiry.pop(dt, None)
+            self._pins.add(dt)
+            self._pinned[dt] = row
+
+    def unpin(self, dt: Optional[date] = None) -> None:
+        """Moves a pinned date, or all of them, back to the LRU."""
+        with self._lock:
+            dates = [dt] if dt is not None else list(self._pins)
+            for day in dates:
+                self._pins.discard(day)
+                row = self._pinned.pop(day, None)
+                if row is not None and self.maxsize > 0:
+                    self._rows[day] = row
+            self._evict()
+
+    def pinned(self) -> Set[date]:
+        with self._lock:
+            return set(self._pins)
+
+    def discard(self, dt: date) -> None:
+        with self._lock:
+            self._rows.pop(dt, None)
+            self._expiry.pop(dt, None)
+            self._pinned.pop(dt, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._rows.clear()
+            self._expiry.clear()
+            self._pins.clear()
+            self._pinned.clear()
+
+    def resize(self, maxsize: int) -> None:
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def _evict(self) -> None:
+        while len(self._rows) > max(self.maxsize, 0):
+            dt, _ = self._rows.popitem(last=False)
+            self._expiry.pop(dt, None)
+
+
+RATES_CACHE = RatesCache(int(os.environ.get("DMON_RATES_MEMORY_CACHE", "1024")))
+
+
+def set_rates_cache_size(maxsize: int) -> None:
+    """Sets the maximum number of dates kept in the in-process rates
+    cache, evicting the least recently used ones if needed. A size of
+    0 disables the cache."""
+    RATES_CACHE.resize(maxsize)
+
+
+def clear_rates_cache() -> None:
+    """Empties the in-process rates cache, pinned dates included. The
+    sqlite cache is not affected."""
+    RATES_CACHE.clear()
+
+
+def parse_rates(rates: Mapping[str, Any]) -> RatesRow:
+    """Converts a mapping of currency codes (in any case) to rates into
+    a dictionary of Currency to Decimal. Unknown currencies and
+    missing values are dropped."""
+    out = {}
+    for code, rate in rates.items():
+        if rate is None:
+            continue
+        currency = CURRENCY_CODES.get(code.lower())
+        if currency is not None:
+            out[currency] = Decimal(rate)
+    return out
 
 
 def maybe_create_cache_table():
-    with get_db_connection() as conn:
+    """Creates the tables of the cache database if they do not exist,
+    and switches it to WAL mode.
+
+    The rates are stored in rate_values, with one row per date and
+    currency. Databases created by earlier versions have instead a
+    wide rates table, with one column per currency; it is still read
+    when a date is not in rate_values, and can be moved to the new
+    layout with `migrate_cache_db`.
+
+    The rate column has no type, so that its values keep the type they
+    are written with: the rates fetched are stored as text, and read
+    back with their exact decimal value, while those of older
+    databases, stored as REAL, give the same values as before.
+    """
+    pool = get_connection_pool()
+    if pool.schema_ready:
+        return
+
+    with pool.writer() as conn:
         cursor = conn.cursor()
-        columns = ", ".join(f'"{currency.value}" TEXT' for currency in Currency)
+        cursor.execute("PRAGMA journal_mode = WAL")
         cursor.execute(
-            f"""CREATE TABLE IF NOT EXISTS rates (
-                       date TEXT PRIMARY KEY, {columns}
+            """CREATE TABLE IF NOT EXISTS rate_values (
+                       date TEXT NOT NULL, currency TEXT NOT NULL, rate NOT NULL,
+                       PRIMARY KEY (date, currency)
+                ) WITHOUT ROWID
+            """
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS rate_values_currency ON rate_values (currency, date)"
+        )
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS rate_resolutions (
+                       date TEXT PRIMARY KEY, resolved_date TEXT, checked_at REAL NOT NULL
+                )
+            """
+        )
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS imported_files (
+                       path TEXT PRIMARY KEY, mtime REAL NOT NULL, size INTEGER NOT NULL,
+                       blob TEXT NOT NULL
                 )
             """
         )
-        conn.commit()
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS fetch_locks (
+                       date TEXT PRIMARY KEY, token TEXT NOT NULL, expires_at REAL NOT NULL
+                )
+            """
+        )
+    pool.schema_ready = True
 
 
-def cache_day_rates(dt: Union[date, str], rates: Dict[str, float]):
+def migrate_cache_db(drop_legacy_table: bool = False) -> int:
+    """Copies the rates in the wide rates table of databases created
+    by earlier versions to rate_values, without replacing rates that
+    are already there. Returns the number of rates copied.
+
+    The old table is kept, so that earlier versions can still use the
+    database, unless `drop_legacy_table` is True.
+    """
     maybe_create_cache_table()
-    with get_db_connection() as conn:
-        valid_currencies = {currency.value for currency in Currency}
-        filtered_rates = {
-            currency: str(rate)
-            for currency, rate in rates.items()
-            if currency.lower() in valid_currencies
-        }
+    with get_db_writer() as conn:
+        cursor = conn.cursor()
+        columns = {row["name"] for row in cursor.execute("PRAGMA table_info(rates)")}
+        if not columns:
+            return 0
+
+        copied = 0
+        for currency in Currency:
+            if currency.value not in columns:
+                continue
+            cursor.execute(
+                f"""INSERT OR IGNORE INTO rate_values (date, currency, rate)
+                    SELECT date, ?, "{currency.value}" FROM rates
+                    WHERE "{currency.value}" IS NOT NULL
+                """,
+                (currency.value,),
+            )
+            copied += cursor.rowcount
 
-        columns = ", ".join(f'"{currency.lower()}"' for currency in filtered_rates.keys())
-        placeholders = ", ".join("?" * len(filtered_rates))
-        values = tuple(filtered_rates.values())
+        if drop_legacy_table:
+            cursor.execute("DROP TABLE rates")
 
-        cursor = conn.cursor()
-        cursor.execute(
-            f"INSERT OR REPLACE INTO rates (date, {columns}) VALUES (?, {placeholders})",
-            (format_date(dt), *values),
+    if drop_legacy_table:
+        with get_db_writer() as conn:
+            conn.execute("VACUUM")
+
+    clear_rates_cache()
+    return copied
+
+
+def rate_values_rows(dt: Union[date, str], rates: Mapping[str, Any]) -> list:
+    """Returns the rows of rate_values for the rates of a date, given as
+    a mapping of currency codes to rates. Unknown currencies and
+    missing rates are left out."""
+    day = format_date(dt)
+    return [
+        (day, code.lower(), str(rate))
+        for code, rate in rates.items()
+        if rate is not None and code.lower() in CURRENCY_CODES
+    ]
+
+
+def cache_day_rates(dt: Union[date, str], rates: Dict[str, float]):
+    maybe_create_cache_table()
+    with metrics.timer("db.cache_day_rates"), get_db_writer() as conn:
+        conn.execute("DELETE FROM rate_values WHERE date = ?", (format_date(dt),))
+        conn.executemany(
+            "INSERT INTO rate_values (date, currency, rate) VALUES (?, ?, ?)",
+            rate_values_rows(dt, rates),
         )
-        conn.commit()
+    RATES_CACHE.discard(parse_date(dt))
+
+
+class RateResolutions:
+    """Remembers how dates without rates of their own were resolved by
+    `find_rates_for_date`: either to the earlier date whose rates were
+    used, or as known to be missing.
+
+    The resolutions are kept in memory and in the rate_resolutions
+    table of the cache database, so that they are shared between
+    processes. They expire after `fallback_ttl` seconds (resolved to
+    an earlier date) or `missing_ttl` seconds (no rates found, or
+    resolved to an earlier date when the rates of the date itself may
+    still be published), after which the sources are queried again.
+    """
+
+    def __init__(self, missing_ttl: float = 3600, fallback_ttl: float = 86400) -> None:
+        self.missing_ttl = missing_ttl
+        self.fallback_ttl = fallback_ttl
+        self._entries: Dict[date, Tuple[Optional[date], float]] = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, dt: date) -> Tuple[bool, Optional[date]]:
+        """Returns whether there is a current resolution for the date,
+        and the date whose rates should be used (None if they are
+        known to be missing)."""
+        with self._lock:
+            entry = self._entries.get(dt)
+        if entry is None:
+            entry = self._load(dt)
+            if entry is None:
+                return False, None
+            with self._lock:
+                self._entries[dt] = entry
+
+        resolved_date, checked_at = entry
+        if resolved_date is None or _is_recent(dt):
+            ttl = self.missing_ttl
+        else:
+            ttl = self.fallback_ttl
+        if time.time() - checked_at > ttl:
+            return False, None
+        return True, resolved_date
+
+    def record(self, dt: date, resolved_date: Optional[date]) -> None:
+        checked_at = time.time()
+        with self._lock:
+            self._entries[dt] = (resolved_date, checked_at)
+
+        maybe_create_cache_table()
+        with get_db_writer() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_resolutions (date, resolved_date, checked_at) "
+                "VALUES (?, ?, ?)",
+                (
+                    format_date(dt),
+                    format_date(resolved_date) if resolved_date is not None else None,
+                    checked_at,
+                ),
+            )
+
+    def clear(self) -> None:
+        """Forgets the resolutions held in memory. The ones stored in
+        the cache database are not affected."""
+        with self._lock:
+            self._entries.clear()
+
+    def _load(self, dt: date) -> Optional[Tuple[Optional[date], float]]:
+        with get_db_connection() as conn:
+            try:
+                row = conn.execute(
+                    "SELECT resolved_date, checked_at FROM rate_resolutions WHERE date = ?",
+                    (format_date(dt),),
+                ).fetchone()
+            except sqlite3.Error:
+                return None
+        if row is None:
+            return None
+        return parse_optional_date(row[0]), row[1]
+
+
+RATE_RESOLUTIONS = RateResolutions(
+    missing_ttl=float(os.environ.get("DMON_MISSING_RATES_TTL", "3600")),
+    fallback_ttl=float(os.environ.get("DMON_FALLBACK_RATES_TTL", "86400")),
+)
+
+
+def git_blob_hash(content: bytes) -> str:
+    """Returns the hash git gives to a file with this content."""
+    import hashlib
+
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
 
+def _read_rates_file(path: str, known_blob: Optional[str]) -> Tuple[str, Optional[list]]:
+    """Reads a rates file, returning its git blob hash and its
+    rate_values rows, or None instead of the rows if the hash is
+    `known_blob`."""
+    with open(path, "rb") as file:
+        content = file.read()
+    blob = git_blob_hash(content)
+    if blob == known_blob:
+        return blob, None
+    date_str = os.path.basename(path).split("-rates.json")[0]
+    return blob, rate_values_rows(date_str, json.loads(content)["conversion_rates"])
+
+
+def fill_cache_db(workers: Optional[int] = None, force: bool = False) -> int:
+    """Imports the rates files in the money directory of the
+    DMON_RATES_REPO repository into the cache database.
+
+    The import is incremental: the modification time, size and git
+    blob hash of each imported file are recorded in the imported_files
+    table, and files are only read again when their modification time
+    or size change, and only imported again when their content does.
+    `force` imports all the files.
+
+    The files are parsed in a pool of `workers` threads, and all the
+    rates are written in a single transaction.
+
+    Returns the number of files imported.
+    """
+    from concurrent.futures import ThreadPoolExecutor
 
-def fill_cache_db():
     maybe_create_cache_table()
+    load_env()
     repo_dir = os.environ.get("DMON_RATES_REPO")
     if repo_dir is None:
         raise ValueError("DMON_RATES_REPO environment variable is not set")
 
-    for filename in os.listdir(os.path.join(repo_dir, "money")):
-        if filename.endswith("-rates.json"):
-            file_path = os.path.join(repo_dir, "money", filename)
-            with open(file_path, "r") as file:
-                data = json.load(file)
-                rates = data["conversion_rates"]
-                date_str = filename.split("-rates.json")[0]
-                cache_day_rates(date_str, rates)
+    with get_db_connection() as conn:
+        imported = {
+            row["path"]: (row["mtime"], row["size"], row["blob"])
+            for row in conn.execute("SELECT path, mtime, size, blob FROM imported_files")
+        }
+
+    candidates = []
+    for entry in os.scandir(os.path.join(repo_dir, "money")):
+        if not entry.name.endswith("-rates.json"):
+            continue
+        stat = entry.stat()
+        known = imported.get(entry.name)
+        if not force and known is not None and known[:2] == (stat.st_mtime, stat.st_size):
+            continue
+        known_blob = known[2] if known is not None and not force else None
+        candidates.append((entry, stat, known_blob))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda c: _read_rates_file(c[0].path, c[2]), candidates))
+
+    files = []
+    dates = []
+    values = []
+    for (entry, stat, _), (blob, rows) in zip(candidates, results):
+        files.append((entry.name, stat.st_mtime, stat.st_size, blob))
+        if rows is not None:
+            dates.append((entry.name.split("-rates.json")[0],))
+            values.extend(rows)
+
+    with metrics.timer("db.fill_cache_db"), get_db_writer() as conn:
+        # The rates of a date are replaced as a whole.
+        conn.executemany("DELETE FROM rate_values WHERE date = ?", dates)
+        conn.executemany("INSERT INTO rate_values (date, currency, rate) VALUES (?, ?, ?)", values)
+        conn.executemany(
+            "INSERT OR REPLACE INTO imported_files (path, mtime, size, blob) VALUES (?, ?, ?, ?)",
+            files,
+        )
+
+    clear_rates_cache()
+    return sum(1 for _, rows in results if rows is not None)
+
+
+class TokenBucket:
+    """Limits calls to `rate` per second on average, allowing bursts of
+    up to `capacity` calls. Thread-safe: `acquire` blocks the calling
+    thread until it is its turn."""
+
+    def __init__(self, rate: float, capacity: float = 1) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            # Taking the token even if it is not there yet reserves the
+            # next one, so that waiting callers are served in order.
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+# Limits the calls to remote sources (Supabase and exchangerate-api);
+# the local repository is not limited.
+REMOTE_RATE_LIMITER: Optional[TokenBucket] = None
+
+
+def set_remote_rate_limit(rate: Optional[float], burst: float = 1) -> None:
+    """Limits the calls to remote rate sources to `rate` per second,
+    process-wide. None removes the limit."""
+    global REMOTE_RATE_LIMITER
+    REMOTE_RATE_LIMITER = TokenBucket(rate, burst) if rate else None
+
+
+# Limits of the calls made by the current thread only, on top of the
+# process-wide one (see `thread_rate_limit`).
+_THREAD_LIMITS = threading.local()
+
+
+@contextmanager
+def thread_rate_limit(limiter: Optional[TokenBucket]):
+    """Limits the calls to remote sources made by the calling thread
+    inside the block with `limiter`, which can be shared by several
+    threads. The calls of other threads are not affected."""
+    previous = getattr(_THREAD_LIMITS, "limiter", None)
+    _THREAD_LIMITS.limiter = limiter
+    try:
+        yield
+    finally:
+        _THREAD_LIMITS.limiter = previous
+
+
+def throttle_remote() -> None:
+    limiter = getattr(_THREAD_LIMITS, "limiter", None)
+    if limiter is not None:
+        limiter.acquire()
+    limiter = REMOTE_RATE_LIMITER
+    if limiter is not None:
+        limiter.acquire()
+
+
+class RepoSync:
+    """Keeps the rates repository up to date and an index of the dates
+    that have a rates file in it.
+
+    The repository is pulled when a date is not in the index, but at
+    most once every `interval` seconds, or else every `interval`
+    seconds in a background thread started with `start`, and then
+    never while looking up dates. The index is read again after each
+    pull, and whenever the money directory is modified.
+    """
+
+    def __init__(self, interval: float = 600) -> None:
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._repo_dir: Optional[str] = None
+        self._dir_mtime: Optional[int] = None
+        self._dates: Set[date] = set()
+        # Serializes the pulls, without blocking the lookups of the index.
+        self._pull_lock = threading.Lock()
+        self._pulled: Optional[Tuple[str, float]] = None
+        self._stop: Optional[threading.Event] = None
+
+    def has(self, repo_dir: str, dt: date) -> bool:
+        """Whether the repository has the rates file of `dt`, pulling it
+        first if it does not and it is time to."""
+        if dt in self.dates(repo_dir):
+            return True
+        if self._stop is None:
+            # Even if another thread did the pull, while this one waited.
+            self.sync(repo_dir)
+        return dt in self.dates(repo_dir)
+
+    def dates(self, repo_dir: str) -> Set[date]:
+        """Returns the dates with a rates file in `repo_dir`."""
+        money_dir = os.path.join(repo_dir, "money")
+        try:
+            dir_mtime = os.stat(money_dir).st_mtime_ns
+        except OSError:
+            dir_mtime = None
+        with self._lock:
+            if repo_dir != self._repo_dir or dir_mtime != self._dir_mtime:
+                self._repo_dir = repo_dir
+                self._dir_mtime = dir_mtime
+                self._dates = _scan_rates_dates(money_dir)
+            return self._dates
+
+    def sync(self, repo_dir: str, force: bool = False) -> bool:
+        """Pulls the repository, unless it was pulled less than
+        `interval` seconds ago and not `force`. Returns whether it was
+        pulled."""
+        with self._pull_lock:
+            now = time.monotonic()
+            if (
+                not force
+                and self._pulled is not None
+                and self._pulled[0] == repo_dir
+                and now - self._pulled[1] < self.interval
+            ):
+                return False
+            self._pulled = (repo_dir, now)
+            self._pull(repo_dir)
+        with self._lock:
+            self._dir_mtime = None  # read the index again
+        return True
+
+    def _pull(self, repo_dir: str) -> None:
+        import subprocess
+
+        log.info("Pulling exchange rates repo")
+        try:
+            with metrics.timer("repo.pull"):
+                subprocess.run(
+                    ["git", "-C", repo_dir, "pull"],
+                    check=True,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                )
+        except (OSError, subprocess.CalledProcessError) as e:
+            log.warning("Could not pull the exchange rates repo: %s", e)
+
+    def start(self, repo_dir: Optional[str] = None) -> None:
+        """Pulls the repository (by default that of DMON_RATES_REPO) every
+        `interval` seconds in a daemon thread, until `stop` is called."""
+        load_env()
+        repo_dir = repo_dir or os.environ.get("DMON_RATES_REPO")
+        if repo_dir is None:
+            raise ValueError("DMON_RATES_REPO environment variable is not set")
+        self.stop()
+        stop = self._stop = threading.Event()
+
+        def run() -> None:
+            while not stop.is_set():
+                self.sync(repo_dir, force=True)
+                stop.wait(self.interval)
+
+        threading.Thread(target=run, name="dmon-repo-sync", daemon=True).start()
+
+    def stop(self) -> None:
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+
+
+def _scan_rates_dates(money_dir: str) -> Set[date]:
+    dates = set()
+    try:
+        entries = os.listdir(money_dir)
+    except OSError:
+        return dates
+    for name in entries:
+        if name.endswith("-rates.json"):
+            try:
+                dates.add(parse_date(name[: -len("-rates.json")]))
+            except ValueError:
+                pass
+    return dates
+
+
+REPO_SYNC = RepoSync(interval=float(os.environ.get("DMON_RATES_REPO_SYNC_INTERVAL", "600")))
 
 
 def get_day_rates_from_repo(on_date: Union[date, str]) -> Optional[Dict[str, float]]:
@@ -169,32 +917,126 @@ def get_day_rates_from_repo(on_date: Union[date, str]) -> Optional[Dict[str, flo
     - DMON_RATES_REPO: directory containing a git repository with the
                        rates files in the money subdirectory.
 
+    - DMON_RATES_REPO_SYNC_INTERVAL: minimum seconds between pulls of
+                                     the repository (600 by default),
+                                     see `RepoSync`.
+
     """
-    print("Attempting to get rates from repo")
+    log.debug("Attempting to get rates from repo")
+    load_env()
     repo_dir = os.environ.get("DMON_RATES_REPO", None)
     if repo_dir is None or not os.path.exists(repo_dir):
         return None
 
-    rates_file_path = os.path.join(repo_dir, "money", format_date(on_date) + "-rates.json")
-    if not os.path.exists(rates_file_path):
-        # Attempt to update the local repository
-        try:
-            print("Pulling exchange rates repo")
-            subprocess.run(
-                ["git", "-C", repo_dir, "pull"],
-                check=True,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-            )
-        except subprocess.CalledProcessError:
-            return None
+    # Missing files may be pulled into the local repository.
+    if not REPO_SYNC.has(repo_dir, parse_date(on_date)):
+        return None
 
-    if os.path.exists(rates_file_path):
+    rates_file_path = os.path.join(repo_dir, "money", format_date(on_date) + "-rates.json")
+    try:
         with open(rates_file_path, "r", encoding="utf-8") as file:
             rates = json.load(file)
             return rates["conversion_rates"]
+    except FileNotFoundError:
+        return None
 
-    return None
+
+_HTTP_SESSION: Optional["requests.Session"] = None
+_HTTP_LOCK = threading.Lock()
+
+EXCHANGERATE_API_URL = "https://v6.exchangerate-api.com/v6"
+
+# Statuses that are retried: too many requests and transient server errors.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def get_http_session() -> "requests.Session":
+    """Returns the HTTP session of the process, created the first time
+    it is needed. Its connections are kept alive and reused, and
+    failed requests are retried with exponential backoff, up to
+    DMON_HTTP_RETRIES times (3 by default), honouring the Retry-After
+    header of 429 and 503 responses for at most
+    DMON_HTTP_MAX_RETRY_AFTER seconds (5 by default)."""
+    global _HTTP_SESSION
+    if _HTTP_SESSION is not None:
+        return _HTTP_SESSION
+
+    with _HTTP_LOCK:
+        if _HTTP_SESSION is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            load_env()
+            max_retry_after = float(os.environ.get("DMON_HTTP_MAX_RETRY_AFTER", "5"))
+
+            class CappedRetry(Retry):
+                def get_retry_after(self, response):
+                    retry_after = super().get_retry_after(response)
+                    if retry_after is None:
+                        return None
+                    return min(retry_after, max_retry_after)
+
+            retry = CappedRetry(
+                total=int(os.environ.get("DMON_HTTP_RETRIES", "3")),
+                backoff_factor=0.5,
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=["GET"],
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_maxsize=10, max_retries=retry)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _HTTP_SESSION = session
+    return _HTTP_SESSION
+
+
+def set_http_session(session: Optional["requests.Session"]) -> None:
+    """Sets the session used to fetch rates over HTTP. None creates a
+    new one the next time it is needed."""
+    global _HTTP_SESSION
+    with _HTTP_LOCK:
+        previous, _HTTP_SESSION = _HTTP_SESSION, session
+    if previous is not None and previous is not session:
+        previous.close()
+
+
+class LatestRates:
+    """The last rates from the `latest` endpoint of exchangerate-api,
+    reused until the time of their next update, and revalidated with
+    their ETag, if the server sent one, after that."""
+
+    def __init__(self) -> None:
+        self._entries: Dict[str, Tuple[float, Optional[str], Dict[str, float]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, url: str) -> Tuple[Optional[Dict[str, float]], Optional[str]]:
+        """Returns the rates of `url` if they are still current, else
+        None, and the ETag of the rates cached."""
+        with self._lock:
+            entry = self._entries.get(url)
+        if entry is None:
+            return None, None
+        next_update, etag, rates = entry
+        return (rates if time.time() < next_update else None), etag
+
+    def revalidated(self, url: str) -> Optional[Dict[str, float]]:
+        """Returns the cached rates of `url`, after a 304 response."""
+        with self._lock:
+            entry = self._entries.get(url)
+        return entry[2] if entry else None
+
+    def put(self, url: str, next_update: float, etag: Optional[str], rates: Dict[str, float]):
+        with self._lock:
+            self._entries[url] = (next_update, etag, rates)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+LATEST_RATES = LatestRates()
 
 
 def fetch_rates_from_exchangerate_api(on_date: Union[date, str]) -> Optional[Dict[str, float]]:
@@ -209,17 +1051,29 @@ def fetch_rates_from_exchangerate_api(on_date: Union[date, str]) -> Optional[Dic
     exchange rate against a base currency (usually USD) for the
     specified date. Returns None if the rates cannot be fetched.
 
+    The requests go through the pooled session of `get_http_session`.
+    The rates of today, from the `latest` endpoint, are kept in
+    memory until the next update announced by the response.
 
     Environment variables:
 
     - DMON_EXCHANGERATE_API_KEY: API key for https://exchangerate-api.com.
 
+    - DMON_EXCHANGERATE_API_URL: Base URL of the API, by default
+      https://v6.exchangerate-api.com/v6.
+
+    - DMON_HTTP_TIMEOUT: Seconds to wait for the server to connect and
+      to respond (10 by default).
+
     The external API used for downloading rates
     (https://exchangerate-api.com) may require a paid plan for
     accessing historical data.
 
     """
 
+    import requests
+
+    load_env()
     api_environment = "DMON_EXCHANGERATE_API_KEY"
     api_key = os.environ.get(api_environment, "")
     if not api_key:
@@ -228,37 +1082,84 @@ def fetch_rates_from_exchangerate_api(on_date: Union[date, str]) -> Optional[Dic
             f"in the environment variable {api_environment}"
         )
 
-    url = f"https://v6.exchangerate-api.com/v6/{api_key}/latest/USD"
-    if parse_date(on_date) != date.today():
+    base_url = os.environ.get("DMON_EXCHANGERATE_API_URL") or EXCHANGERATE_API_URL
+    base_url = base_url.rstrip("/") + f"/{api_key}"
+    latest = parse_date(on_date) == date.today()
+    url = f"{base_url}/latest/USD"
+    headers = {}
+    if latest:
+        rates, etag = LATEST_RATES.get(url)
+        if rates is not None:
+            return rates
+        if etag:
+            headers["If-None-Match"] = etag
+    else:
         # Requires a paid plan
         # https://v6.exchangerate-api.com/v6/YOUR-API-KEY/history/USD/YEAR/MONTH/DAY
-        url = f"https://v6.exchangerate-api.com/v6/{api_key}/history/USD/" + format_date(
-            on_date
-        ).replace("-", "/")
+        url = f"{base_url}/history/USD/" + format_date(on_date).replace("-", "/")
+
+    throttle_remote()
+    try:
+        response = get_http_session().get(
+            url, headers=headers, timeout=float(os.environ.get("DMON_HTTP_TIMEOUT", "10"))
+        )
+    except requests.RequestException as e:
+        log.warning("Failed to fetch rates for %s: %s", on_date, e)
+        return None
 
-    response = requests.get(url)
+    if latest and response.status_code == 304:
+        return LATEST_RATES.revalidated(url)
 
     if response.status_code == 200:  # Checks if the request was successful
-        rates = response.json()
+        body = response.json()
         # Checks if 'conversion_rates' is in the response and returns it, otherwise returns None
-        return rates.get("conversion_rates")
+        rates = body.get("conversion_rates")
+        if latest and rates and body.get("time_next_update_unix"):
+            LATEST_RATES.put(
+                url, float(body["time_next_update_unix"]), response.headers.get("ETag"), rates
+            )
+        return rates
     else:
         # Log or handle unsuccessful request appropriately
-        print(f"Failed to fetch rates for {on_date}: HTTP {response.status_code}")
+        log.warning("Failed to fetch rates for %s: HTTP %s", on_date, response.status_code)
         return None
 
 
+_SUPABASE_CLIENT: Optional["Client"] = None
+_SUPABASE_LOCK = threading.Lock()
+# The client whose project does not have get_rates_for_date_range.
+_SUPABASE_NO_RANGE: Optional["Client"] = None
+
+
 def get_supabase_client() -> Optional["Client"]:
-    """Get a Supabase client if credentials are available"""
+    """Returns the Supabase client of the process, creating it the
+    first time it is needed, or None if there are no credentials."""
+    global _SUPABASE_CLIENT
+    if _SUPABASE_CLIENT is not None:
+        return _SUPABASE_CLIENT
+
+    load_env()
     url = os.environ.get("SUPABASE_URL")
     key = os.environ.get("SUPABASE_KEY")  # This should be the anon key, not service role
 
     if not url or not key:
         return None
 
-    from supabase import create_client
+    with _SUPABASE_LOCK:
+        if _SUPABASE_CLIENT is None:
+            from supabase import create_client
+
+            _SUPABASE_CLIENT = create_client(url, key)
+    return _SUPABASE_CLIENT
 
-    return create_client(url, key)
+
+def set_supabase_client(client: Optional["Client"]) -> None:
+    """Sets the Supabase client used to fetch rates, for instance one
+    with custom options. None creates a new one from the environment
+    the next time it is needed."""
+    global _SUPABASE_CLIENT
+    with _SUPABASE_LOCK:
+        _SUPABASE_CLIENT = client
 
 
 def get_day_rates_from_supabase(on_date: Union[date, str]) -> Optional[Dict[str, float]]:
@@ -280,7 +1181,8 @@ def get_day_rates_from_supabase(on_date: Union[date, str]) -> Optional[Dict[str,
         return None
 
     try:
-        print("Trying to get rates from supabase")
+        log.debug("Trying to get rates from supabase")
+        throttle_remote()
         response = client.rpc(
             "get_rates_for_date", {"target_date": format_date(on_date)}
         ).execute()
@@ -288,11 +1190,69 @@ def get_day_rates_from_supabase(on_date: Union[date, str]) -> Optional[Dict[str,
         if response.data:
             return response.data["conversion_rates"]
     except Exception as e:
-        print(f"Error fetching rates from Supabase: {e}")
+        log.warning("Error fetching rates from Supabase: %s", e)
 
     return None
 
 
+def get_rates_range_from_supabase(
+    from_date: Union[date, str], to_date: Union[date, str], fallback: bool = True
+) -> Optional[Dict[date, Dict[str, float]]]:
+    """Fetches the exchange rates of all the dates of a period (both
+    ends included) from Supabase in a single call to the
+    get_rates_for_date_range function, which returns a row with the
+    date and the conversion_rates of each date that has rates.
+
+    Returns a dictionary from the dates to their rates, without the
+    dates that have no rates. If the range function cannot be called,
+    the dates are fetched one by one with `get_day_rates_from_supabase`
+    or, if not `fallback`, None is returned. After the first failure
+    the function is not called again with the same client. Without
+    Supabase credentials the result is empty.
+    """
+    global _SUPABASE_NO_RANGE
+    client = get_supabase_client()
+    if not client:
+        return {}
+
+    dt, to_dt = parse_date(from_date), parse_date(to_date)
+    if client is not _SUPABASE_NO_RANGE:
+        try:
+            throttle_remote()
+            response = client.rpc(
+                "get_rates_for_date_range",
+                {"start_date": format_date(dt), "end_date": format_date(to_dt)},
+            ).execute()
+            return {
+                parse_date(row["date"]): row["conversion_rates"]
+                for row in response.data or []
+                if row.get("conversion_rates")
+            }
+        except Exception as e:
+            log.warning("Error fetching a range of rates from Supabase, not trying again: %s", e)
+            _SUPABASE_NO_RANGE = client
+    if not fallback:
+        return None
+
+    out = {}
+    while dt <= to_dt:
+        rates = get_day_rates_from_supabase(dt)
+        if rates:
+            out[dt] = rates
+        dt = dt + timedelta(days=1)
+    return out
+
+
+# How many days `find_rates_for_date` looks back for rates.
+MAX_DAYS_BACK = 10
+
+
+def _is_recent(dt: date) -> bool:
+    """Whether the rates of `dt` may still be published, if it has
+    none yet: it is less than MAX_DAYS_BACK days old."""
+    return (date.today() - dt).days < MAX_DAYS_BACK
+
+
 def find_rates_for_date(
     on_date: Union[date, str]
 ) -> Tuple[Optional[Dict[str, float]], Optional[date]]:
@@ -304,33 +1264,62 @@ def find_rates_for_date(
     Returns:
     - Tuple of (rates_dict, actual_date) if found, or (None, None) if no rates found
     """
+    load_env()
     current_date = parse_date(on_date)
-    max_days_back = 10  # Limit how far back we look to avoid infinite loops
+    max_days_back = MAX_DAYS_BACK  # Limit how far back we look to avoid infinite loops
     days_checked = 0
 
+    # The first time the repository does not have the rates, those of
+    # all the remaining days are fetched from Supabase in one call.
+    supabase_window: Optional[Dict[date, Dict[str, float]]] = None
+    window_fetched = False
+
     while days_checked < max_days_back:
         # Try getting rates for current date
-        rates = get_day_rates_from_repo(current_date)
-        if rates:
-            return rates, current_date
+        rates = _from_source("repo", get_day_rates_from_repo, current_date)
+        if not rates and not window_fetched:
+            window_fetched = True
+            first_date = current_date - timedelta(days=max_days_back - 1 - days_checked)
+            with metrics.timer("source.supabase_range"):
+                supabase_window = get_rates_range_from_supabase(
+                    first_date, current_date, fallback=False
+                )
+        if not rates and supabase_window is not None:
+            rates = supabase_window.get(current_date)
+            if rates:
+                metrics.increment("source.supabase.found")
+        elif not rates:
+            # The Supabase project does not have the range function.
+            rates = _from_source("supabase", get_day_rates_from_supabase, current_date)
+
+        # Only try exchangerate API for the actual requested date
+        if not rates and days_checked == 0 and os.environ.get("DMON_EXCHANGERATE_API_KEY"):
+            rates = _from_source("api", fetch_rates_from_exchangerate_api, current_date)
 
-        rates = get_day_rates_from_supabase(current_date)
         if rates:
+            metrics.observe("fallback.depth", days_checked, metrics.DEPTH_BUCKETS)
             return rates, current_date
 
-        # Only try exchangerate API for the actual requested date
-        if days_checked == 0:
-            rates = fetch_rates_from_exchangerate_api(current_date)
-            if rates:
-                return rates, current_date
-
         # Move to previous day
-        current_date = current_date - relativedelta(days=1)
+        current_date = current_date - timedelta(days=1)
         days_checked += 1
 
+    metrics.increment("fallback.not_found")
     return None, None
 
 
+def _from_source(
+    name: str, fetch: Callable[[date], Optional[Dict[str, float]]], on_date: date
+) -> Optional[Dict[str, float]]:
+    """Calls a rate source, recording its latency and whether it had
+    the rates."""
+    with metrics.timer(f"source.{name}"):
+        rates = fetch(on_date)
+    if rates:
+        metrics.increment(f"source.{name}.found")
+    return rates
+
+
 def get_rates(
     on_date: Union[date, str], *currencies: Currency
 ) -> Optional[Dict[Currency, Optional[Decimal]]]:
@@ -339,20 +1328,28 @@ def get_rates(
     it will attempt to find rates from the most recent previous date
     (up to 10 days back).
 
-    This function first attempts to fetch the rates from the local
-    database. If the rates are not found, it tries these sources in order:
+    Rows already used in this process are served from an in-memory
+    LRU (see `RatesCache`). Otherwise this function attempts to fetch
+    the rates from the local database. If the rates are not found, it
+    tries these sources in order:
     1. Local git repository (if DMON_RATES_REPO is set)
     2. Supabase (if SUPABASE_URL and SUPABASE_KEY are set)
     3. exchangerate-api (if DMON_EXCHANGERATE_API_KEY is set)
 
     Once fetched from any source, the rates are cached in the local
-    database for future use.
+    database for future use. How a date without rates of its own was
+    resolved (to an earlier date, or as missing) is also remembered,
+    for DMON_FALLBACK_RATES_TTL and DMON_MISSING_RATES_TTL seconds
+    respectively, so that repeated lookups do not query the sources.
+    Dates of the last 10 days resolved to an earlier date use the
+    shorter DMON_MISSING_RATES_TTL, as their own rates may appear.
 
     Arguments:
     - on_date: The date for which to fetch the exchange rates, either
                as a date or as a string in the 'YYYY-MM-DD' format.
     - [currencies]: Variable length argument list of Currency enum
-                    members for which to fetch the exchange rates.
+                    members for which to fetch the exchange rates. All
+                    the known rates are returned if none is given.
 
     Returns a dictionary mapping each requested currency to its
     exchange rate against the base currency for the specified
@@ -364,42 +1361,479 @@ def get_rates(
     - SUPABASE_URL: Supabase project URL
     - SUPABASE_KEY: Supabase anon key
     - DMON_EXCHANGERATE_API_KEY: API key for exchangerate-api.com
+    - DMON_RATES_MEMORY_CACHE: number of dates kept in the in-process
+                               cache (1024 by default, 0 disables it).
+    - DMON_RATES_SNAPSHOT: binary snapshot of the cache, looked up
+                           before the sqlite database (see
+                           `export_snapshot`).
     """
+    cross_rates = get_cross_rates(on_date)
+    if cross_rates is None:
+        return None
+
+    if not currencies:
+        return dict(cross_rates.rates)
+    return {currency: cross_rates.rates.get(currency) for currency in currencies}
+
+
+def get_cross_rates(on_date: Union[date, str]) -> Optional[CrossRates]:
+    """Returns the `CrossRates` for a date, from the in-process cache
+    if possible, or None if no rates can be found. See `get_rates` for
+    how the rates are looked for.
+
+    The rates of an earlier date used for a recent date are only kept
+    in the in-process cache for DMON_MISSING_RATES_TTL seconds, so
+    that its own rates are used once they are published."""
+    dt = parse_date(on_date)
+    cross_rates = RATES_CACHE.get(dt)
+    if cross_rates is None:
+        if TODAY_REFRESHER.serve_stale:
+            cross_rates = TODAY_REFRESHER.stale(dt)
+            if cross_rates is not None:
+                return cross_rates
+        metrics.increment("rates.cache.miss")
+        snapshot = get_snapshot()
+        row = snapshot.rates(dt) if snapshot is not None else None
+        found_date: Optional[date] = dt
+        if row is not None:
+            metrics.increment("rates.snapshot.hit")
+        else:
+            row, found_date = load_day_rates(dt)
+            if row is None or found_date is None:
+                return None
+        cross_rates = CrossRates(found_date, row)
+        if found_date == dt or not _is_recent(dt):
+            RATES_CACHE.put(dt, cross_rates)
+        else:
+            # The rates of a recent date may still be published.
+            RATES_CACHE.put(dt, cross_rates, ttl=RATE_RESOLUTIONS.missing_ttl)
+    elif metrics.ENABLED:
+        metrics.METRICS.increment("rates.cache.hit")
+    return cross_rates
+
+
+_SNAPSHOT: Optional[RatesSnapshot] = None
+_SNAPSHOT_LOADED = False
+
+
+def load_snapshot(path: Optional[str]) -> Optional[RatesSnapshot]:
+    """Maps the rates snapshot in `path` (see `export_snapshot`), whose
+    rates are then used before looking in the sqlite cache. None stops
+    using a snapshot.
+
+    Snapshots are also loaded the first time they are needed from the
+    path in the DMON_RATES_SNAPSHOT environment variable, if set.
+    """
+    global _SNAPSHOT, _SNAPSHOT_LOADED
+    with _POOL_LOCK:
+        previous = _SNAPSHOT
+        _SNAPSHOT = RatesSnapshot(path) if path else None
+        _SNAPSHOT_LOADED = True
+    RATES_CACHE.clear()
+    if previous is not None:
+        previous.close()
+    return _SNAPSHOT
+
+
+def get_snapshot() -> Optional[RatesSnapshot]:
+    if not _SNAPSHOT_LOADED:
+        load_env()
+        load_snapshot(os.environ.get("DMON_RATES_SNAPSHOT"))
+    return _SNAPSHOT
+
+
+def export_snapshot(path: str) -> int:
+    """Writes all the rates in the sqlite cache to a binary snapshot
+    in `path`, that can be memory-mapped with `load_snapshot`. Returns
+    the number of dates written."""
     with get_db_connection() as conn:
+        bounds = []
+        for query in (
+            "SELECT MIN(date), MAX(date) FROM rate_values",
+            "SELECT MIN(date), MAX(date) FROM rates",
+        ):
+            try:
+                bounds.extend(d for d in conn.execute(query).fetchone() if d is not None)
+            except sqlite3.Error:
+                pass
+
+    rows = select_rates_range(parse_date(min(bounds)), parse_date(max(bounds))) if bounds else {}
+    write_snapshot(path, rows)
+    return len(rows)
+
+
+def select_day_rates(on_date: date) -> Optional[RatesRow]:
+    """Reads the rates of a date from the sqlite cache, or returns None
+    if they are not there."""
+    day = format_date(on_date)
+    with metrics.timer("db.select_day_rates"), get_db_connection() as conn:
         cursor = conn.cursor()
-        placeholders = ", ".join(f'"{currency.value}"' for currency in currencies)
-        if not placeholders:
-            placeholders = "*"
+        try:
+            cursor.execute("SELECT currency, rate FROM rate_values WHERE date = ?", (day,))
+            rates = parse_rates(dict(cursor.fetchall()))
+        except sqlite3.Error:
+            rates = {}
+
+        if not rates:
+            # Databases created by earlier versions.
+            try:
+                cursor.execute("SELECT * FROM rates WHERE date = ?", (day,))
+                row = cursor.fetchone()
+            except sqlite3.Error:
+                row = None
+            if row:
+                rates = parse_legacy_row(row)
+
+    return rates or None
 
+
+def select_rates_range(from_date: date, to_date: date) -> Dict[date, RatesRow]:
+    """Reads the rates of all the dates in a period (both ends
+    included) from the sqlite cache in a single query. Dates that are
+    not in the cache are not in the result."""
+    period = (format_date(from_date), format_date(to_date))
+    out: Dict[date, RatesRow] = {}
+    with metrics.timer("db.select_rates_range"), get_db_connection() as conn:
+        cursor = conn.cursor()
         try:
             cursor.execute(
-                f"SELECT {placeholders} FROM rates WHERE date = ?", (format_date(on_date),)
+                "SELECT date, currency, rate FROM rate_values WHERE date BETWEEN ? AND ?",
+                period,
             )
-            row = cursor.fetchone()
-        except:
-            row = None
+            for day, code, rate in cursor:
+                currency = CURRENCY_CODES.get(code)
+                if currency is not None:
+                    out.setdefault(parse_date(day), {})[currency] = Decimal(rate)
+        except sqlite3.Error:
+            pass
+
+        # Databases created by earlier versions.
+        try:
+            cursor.execute("SELECT * FROM rates WHERE date BETWEEN ? AND ?", period)
+            for row in cursor:
+                out.setdefault(parse_date(row["date"]), parse_legacy_row(row))
+        except sqlite3.Error:
+            pass
 
-        out = None
-        if row:
-            out = {currency: row[i] for i, currency in enumerate(currencies)}
-        else:
-            # If not in cache, try to find rates from the requested date or earlier
-            rates, found_date = find_rates_for_date(on_date)
+    return dict(sorted(out.items()))
 
-            if rates:
 
-                if found_date:
-                    cache_day_rates(found_date, rates)
+def parse_legacy_row(row: sqlite3.Row) -> RatesRow:
+    return parse_rates({k: v for k, v in zip(row.keys(), row) if k != "date"})
 
-                if found_date != parse_date(on_date):
-                    print(f"Using rates from {found_date} for {on_date}")
 
-                out = {currency: rates.get(currency.value.upper()) for currency in currencies}
+class SingleFlight:
+    """Runs a function once for all the threads that ask for the same
+    key at the same time: the first one runs it, and the others wait
+    for its result, or its exception."""
 
-        if out:
-            return {c: Decimal(v) if v is not None else None for c, v in out.items()}
+    class _Call:
+        __slots__ = ("done", "result", "error")
 
-        return None
+        def __init__(self) -> None:
+            self.done = threading.Event()
+            self.result: Any = None
+            self.error: Optional[BaseException] = None
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[Any, "SingleFlight._Call"] = {}
+
+    def do(self, key: Any, func: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if call is None:
+                call = self._calls[key] = self._Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class FetchLocks:
+    """Locks, in the fetch_locks table of the cache database, of the
+    dates whose rates are being fetched from the sources, so that the
+    processes that share the database fetch each date only once.
+
+    Disabled unless `enabled`, or the DMON_RATES_PROCESS_LOCKS
+    environment variable is set. Locks expire after `ttl` seconds, in
+    case their process dies while holding them, and processes waiting
+    for a lock check every `poll_interval` seconds whether its rates
+    have arrived.
+    """
+
+    def __init__(self, enabled: bool = False, ttl: float = 60, poll_interval: float = 0.1):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+
+    def acquire(self, dt: date) -> Optional[str]:
+        """Takes the lock of a date, if it is free or expired. Returns
+        the token to release it with, or None if it is held."""
+        maybe_create_cache_table()
+        token = f"{os.getpid()}:{threading.get_ident()}:{time.time()}"
+        now = time.time()
+        with get_db_writer() as conn:
+            day = format_date(dt)
+            conn.execute("DELETE FROM fetch_locks WHERE date = ? AND expires_at < ?", (day, now))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO fetch_locks (date, token, expires_at) VALUES (?, ?, ?)",
+                (day, token, now + self.ttl),
+            )
+            return token if cursor.rowcount == 1 else None
+
+    def release(self, dt: date, token: str) -> None:
+        with get_db_writer() as conn:
+            conn.execute(
+                "DELETE FROM fetch_locks WHERE date = ? AND token = ?", (format_date(dt), token)
+            )
+
+
+FETCH_LOCKS = FetchLocks(
+    enabled=_env_flag("DMON_RATES_PROCESS_LOCKS"),
+    ttl=float(os.environ.get("DMON_RATES_LOCK_TTL", "60")),
+)
+
+_LOAD_FLIGHTS = SingleFlight()
+
+
+def load_day_rates(on_date: date) -> Tuple[Optional[RatesRow], Optional[date]]:
+    """Loads the full row of rates for a date, bypassing the
+    in-process cache: first from the sqlite cache, then following a
+    previous resolution of the date (see `RateResolutions`) and, if
+    there is none, from the sources in `find_rates_for_date`, caching
+    what it finds.
+
+    Threads that load the same date at the same time wait for the
+    first one to do it (see `SingleFlight`) and, with `FETCH_LOCKS`
+    enabled, so do other processes that share the cache database.
+
+    Returns a tuple with the rates and the date they belong to, or
+    (None, None) if there are no rates for the date.
+    """
+    return _LOAD_FLIGHTS.do(on_date, lambda: _load_day_rates(on_date))
+
+
+def _load_day_rates(on_date: date) -> Tuple[Optional[RatesRow], Optional[date]]:
+    cached = _cached_day_rates(on_date)
+    if cached is not None:
+        return cached
+
+    token = None
+    while FETCH_LOCKS.enabled and token is None:
+        token = FETCH_LOCKS.acquire(on_date)
+        if token is None:
+            # Another process is fetching the date: use what it finds.
+            time.sleep(FETCH_LOCKS.poll_interval)
+        cached = _cached_day_rates(on_date)
+        if cached is not None:
+            if token is not None:
+                FETCH_LOCKS.release(on_date, token)
+            return cached
+
+    try:
+        return _fetch_day_rates(on_date)
+    finally:
+        if token is not None:
+            FETCH_LOCKS.release(on_date, token)
+
+
+def _cached_day_rates(on_date: date) -> Optional[Tuple[Optional[RatesRow], Optional[date]]]:
+    """Returns the result of `load_day_rates` if it can be found
+    without querying the sources, else None."""
+    row = select_day_rates(on_date)
+    if row is not None:
+        return row, on_date
+
+    known, resolved_date = RATE_RESOLUTIONS.lookup(on_date)
+    if known:
+        if resolved_date is None:
+            return None, None
+        row = select_day_rates(resolved_date)
+        if row is not None:
+            return row, resolved_date
+    return None
+
+
+def _fetch_day_rates(on_date: date) -> Tuple[Optional[RatesRow], Optional[date]]:
+    # If not in cache, try to find rates from the requested date or earlier
+    rates, found_date = find_rates_for_date(on_date)
+    if not rates or found_date is None:
+        RATE_RESOLUTIONS.record(on_date, None)
+        return None, None
+
+    cache_day_rates(found_date, rates)
+
+    if found_date != on_date:
+        log.info("Using rates from %s for %s", found_date, on_date)
+        RATE_RESOLUTIONS.record(on_date, found_date)
+
+    # Read back what was cached, so that the rates are the same whether
+    # they were just fetched or not.
+    return select_day_rates(found_date) or parse_rates(rates), found_date
+
+
+class TodayRefresher:
+    """Loads the rates of the current day in a background thread, so
+    that the conversions dated today do not wait for the rate sources.
+
+    Once started with `start`, it looks for today's rates right away,
+    then every `interval` seconds until they are published, and again
+    when the day changes. Today's rates are cached and pinned in
+    `RATES_CACHE` (those of the day before are unpinned).
+
+    With `serve_stale`, the conversions dated today that find no rates
+    for it in memory use instead the latest rates the refresher has
+    found, those of an earlier day, and wake it up to look for today's,
+    so that no conversion waits for the sources after midnight.
+    """
+
+    def __init__(
+        self,
+        interval: float = 300,
+        serve_stale: bool = False,
+        clock: Callable[[], date] = date.today,
+    ) -> None:
+        self.interval = interval
+        self.serve_stale = serve_stale
+        self.clock = clock
+        self._latest: Optional[CrossRates] = None
+        self._pinned: Optional[date] = None
+        self._wake = threading.Event()
+        self._stop: Optional[threading.Event] = None
+
+    def refresh(self, today: Optional[date] = None) -> bool:
+        """Looks for the rates of `today` (by default, of the current
+        day) once. Returns whether they were found."""
+        today = today or self.clock()
+        row = select_day_rates(today)
+        found_date: Optional[date] = today
+        if row is None:
+            rates, found_date = find_rates_for_date(today)
+            if not rates or found_date is None:
+                return False
+            cache_day_rates(found_date, rates)
+            row = select_day_rates(found_date) or parse_rates(rates)
+        cross_rates = CrossRates(found_date, row)
+        self._latest = cross_rates
+        if found_date != today:
+            return False
+
+        RATES_CACHE.pin(today, cross_rates)
+        if self._pinned is not None and self._pinned != today:
+            RATES_CACHE.unpin(self._pinned)
+        self._pinned = today
+        metrics.increment("rates.today.refreshed")
+        return True
+
+    def stale(self, dt: date) -> Optional[CrossRates]:
+        """Returns the latest rates found for a conversion dated today,
+        `dt`, or None if it is not today or there are none."""
+        latest = self._latest
+        if latest is None or dt <= latest.on_date or dt != self.clock():
+            return None
+        metrics.increment("rates.stale")
+        self._wake.set()
+        return latest
+
+    def start(self) -> None:
+        """Refreshes today's rates in a daemon thread until `stop` is
+        called."""
+        load_env()
+        self.stop()
+        stop = self._stop = threading.Event()
+
+        def run() -> None:
+            while not stop.is_set():
+                today = self.clock()
+                if self._pinned != today:
+                    try:
+                        self.refresh(today)
+                    except Exception as e:
+                        log.warning("Could not refresh the rates of %s: %s", today, e)
+                now = datetime.now()
+                midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+                timeout = (midnight - now).total_seconds() + 1
+                if self._pinned != today:
+                    timeout = min(timeout, self.interval)
+                self._wake.wait(timeout)
+                self._wake.clear()
+
+        threading.Thread(target=run, name="dmon-today-rates", daemon=True).start()
+
+    def stop(self) -> None:
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+            self._wake.set()
+
+
+TODAY_REFRESHER = TodayRefresher(
+    interval=float(os.environ.get("DMON_TODAY_RATES_REFRESH_INTERVAL", "300")),
+    serve_stale=_env_flag("DMON_SERVE_STALE_RATES"),
+)
+
+
+def get_rates_range(
+    from_date: Union[date, str], to_date: Union[date, str], *currencies: Currency
+) -> Dict[date, Dict[Currency, Optional[Decimal]]]:
+    """Retrieves the exchange rates for the specified currencies on
+    every day of a period, both ends included.
+
+    The rates of all the days already in the sqlite cache are read
+    with a single query. The days that are missing are looked for as
+    in `get_rates`, falling back to earlier dates and querying the
+    sources if needed, so the result is the same as calling
+    `get_rates` for each day.
+
+    Arguments:
+    - from_date, to_date: The first and last days of the period, either
+                          as dates or as strings in the 'YYYY-MM-DD'
+                          format.
+    - [currencies]: Currency enum members for which to fetch the
+                    exchange rates. All the known rates are returned if
+                    none is given.
+
+    Returns a dictionary mapping each day of the period to its rates,
+    as returned by `get_rates`. Days for which no rates can be found
+    are left out.
+    """
+    start, end = parse_date(from_date), parse_date(to_date)
+    cached = select_rates_range(start, end)
+
+    out = {}
+    dt = start
+    while dt <= end:
+        cross_rates = RATES_CACHE.get(dt)
+        if cross_rates is None:
+            if dt in cached:
+                cross_rates = CrossRates(dt, cached[dt])
+                RATES_CACHE.put(dt, cross_rates)
+            else:
+                cross_rates = get_cross_rates(dt)
+
+        if cross_rates is not None:
+            if currencies:
+                out[dt] = {currency: cross_rates.rates.get(currency) for currency in currencies}
+            else:
+                out[dt] = dict(cross_rates.rates)
+        dt += timedelta(days=1)
+
+    return out
 
 
 def get_rate(on_date: Union[date, str], currency: Currency) -> Optional[Decimal]:
@@ -410,7 +1844,29 @@ def get_rate(on_date: Union[date, str], currency: Currency) -> Optional[Decimal]
     return None
 
 
-def fetch_period_rates(from_date: Union[date, str], to_date: Union[date, str]) -> None:
+def select_cached_dates(from_date: date, to_date: date) -> Set[date]:
+    """Returns the dates of a period (both ends included) that have
+    rates in the sqlite cache."""
+    period = (format_date(from_date), format_date(to_date))
+    dates = set()
+    with metrics.timer("db.select_cached_dates"), get_db_connection() as conn:
+        for query in (
+            "SELECT DISTINCT date FROM rate_values WHERE date BETWEEN ? AND ?",
+            "SELECT date FROM rates WHERE date BETWEEN ? AND ?",
+        ):
+            try:
+                dates.update(parse_date(row[0]) for row in conn.execute(query, period))
+            except sqlite3.Error:
+                pass
+    return dates
+
+
+def fetch_period_rates(
+    from_date: Union[date, str],
+    to_date: Union[date, str],
+    concurrency: int = 4,
+    rate_limit: Optional[float] = 2,
+) -> Dict[str, int]:
     """Builds a rates cache by querying the rates for each day in a
     period. If you don't have a repository with the conversion rates
     json files, it will attempt to download them from
@@ -418,6 +1874,16 @@ def fetch_period_rates(from_date: Union[date, str], to_date: Union[date, str]) -
 
     You will need a paid API key for this.
 
+    The days are fetched concurrently. Days already in the cache, or
+    whose resolution to an earlier date (or as missing) is still
+    current, are skipped; since each day is stored as soon as it is
+    fetched, an interrupted backfill resumes where it was left when
+    run again.
+
+    The rates that Supabase has for the days of the period that are
+    not in the local repository are first fetched with a single call
+    (see `get_rates_range_from_supabase`).
+
     Arguments:
 
     - from_date: First date to add to the cache, as a date object or a
@@ -426,14 +1892,123 @@ def fetch_period_rates(from_date: Union[date, str], to_date: Union[date, str]) -
     - to_date: Last date to add to the cache, as a date object or a
                string in yyyy-mm-dd format.
 
+    - concurrency: Number of days fetched at the same time.
+
+    - rate_limit: Maximum number of calls per second to the remote
+                  sources (Supabase and exchangerate-api) made by the
+                  backfill, or None for no limit. The local repository
+                  is not limited, and the process-wide limit of
+                  `set_remote_rate_limit` still applies.
+
+    Returns the number of days that were skipped, fetched, and that
+    could not be found.
     """
-    print(f"Downloading rates from {from_date} to {to_date}")
+    from concurrent.futures import ThreadPoolExecutor
+
+    log.info("Downloading rates from %s to %s", from_date, to_date)
     dt = parse_date(from_date)
     to_dt = parse_date(to_date)
+    cached = select_cached_dates(dt, to_dt)
+
+    pending = []
+    skipped = 0
     while dt <= to_dt:
-        get_rates(str(dt))
-        time.sleep(0.5)
-        dt = dt + relativedelta(days=1)
+        if dt in cached or RATE_RESOLUTIONS.lookup(dt)[0]:
+            skipped += 1
+        else:
+            pending.append(dt)
+        dt = dt + timedelta(days=1)
+
+    # Only the calls of the backfill are limited, not those of other
+    # threads converting amounts meanwhile.
+    limiter = TokenBucket(rate_limit) if rate_limit else None
+
+    def load(dt: date) -> Tuple[Optional[RatesRow], Optional[date]]:
+        with thread_rate_limit(limiter):
+            return load_day_rates(dt)
+
+    # What Supabase has of the days that are not in the repository is
+    # fetched in a single call.
+    repo_dir = os.environ.get("DMON_RATES_REPO")
+    in_repo = REPO_SYNC.dates(repo_dir) if repo_dir else set()
+    remote = [dt for dt in pending if dt not in in_repo]
+    window = {}
+    if remote:
+        with thread_rate_limit(limiter):
+            window = get_rates_range_from_supabase(remote[0], remote[-1], fallback=False) or {}
+    prefetched = [dt for dt in remote if dt in window]
+    for dt in prefetched:
+        cache_day_rates(dt, window[dt])
+    pending = [dt for dt in pending if dt not in window]
+
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        found = [row is not None for row, _ in executor.map(load, pending)]
+
+    fetched = len(prefetched) + sum(found)
+    summary = {"skipped": skipped, "fetched": fetched, "missing": len(found) - sum(found)}
+    log.info(
+        "Fetched %d days, skipped %d already cached, %d not found",
+        summary["fetched"],
+        summary["skipped"],
+        summary["missing"],
+    )
+    return summary
+
+
+def preload(
+    from_date: Union[date, str],
+    to_date: Union[date, str],
+    currencies: Optional[Iterable[Currency]] = None,
+    strict: bool = False,
+    fetch: bool = False,
+) -> Dict[str, Any]:
+    """Loads the rates of every day of a period (both ends included)
+    into the in-process cache and pins them there (see
+    `RatesCache.pin`), so that conversions on those days never reach
+    the sqlite cache or the rate sources. Meant to be called when a
+    service starts.
+
+    The rates already in the sqlite cache are read with a single
+    query, and the other days are looked for as in `get_rates`,
+    falling back to earlier dates. With `fetch`, the days missing from
+    the sqlite cache are first fetched with `fetch_period_rates`.
+
+    Returns a dictionary with the number of days `loaded`, how many of
+    them use the rates of an earlier date (`fallback`), and the list
+    of days with no rates, or without the rates of some of
+    `currencies` (`missing`). With `strict` a RuntimeError is raised
+    instead if any day is missing, and nothing is pinned.
+    """
+    start, end = parse_date(from_date), parse_date(to_date)
+    currencies = tuple(currencies or ())
+    if fetch:
+        fetch_period_rates(start, end)
+    cached = select_rates_range(start, end)
+
+    loaded: Dict[date, CrossRates] = {}
+    missing = []
+    dt = start
+    while dt <= end:
+        cross_rates = CrossRates(dt, cached[dt]) if dt in cached else get_cross_rates(dt)
+        if cross_rates is None or any(c not in cross_rates.rates for c in currencies):
+            missing.append(dt)
+        else:
+            loaded[dt] = cross_rates
+        dt = dt + timedelta(days=1)
+
+    if strict and missing:
+        raise RuntimeError(
+            f"Missing rates for {len(missing)} days between {start} and {end}, "
+            f"the first on {missing[0]}"
+        )
+
+    for dt, cross_rates in loaded.items():
+        RATES_CACHE.pin(dt, cross_rates)
+    return {
+        "loaded": len(loaded),
+        "fallback": sum(cross_rates.on_date != dt for dt, cross_rates in loaded.items()),
+        "missing": missing,
+    }
 
 
 def main():
@@ -451,6 +2026,22 @@ def main():
         action="store_true",
         help="Create the currency rates cache table",
     )
+    parser.add_argument(
+        "--migrate",
+        action="store_true",
+        help="Move the rates of a cache database created by earlier versions to the new layout",
+    )
+    parser.add_argument(
+        "--drop-legacy-table",
+        action="store_true",
+        help="With --migrate, remove the old rates table once migrated",
+    )
+    parser.add_argument(
+        "--export-snapshot",
+        metavar="PATH",
+        help="Write the cached rates to a binary snapshot that can be memory-mapped "
+        "(see DMON_RATES_SNAPSHOT)",
+    )
     parser.add_argument(
         "-r",
         "--rate-on",
@@ -463,22 +2054,78 @@ def main():
         "--fetch-rates",
         help="Retrieve the exchange rates of all the days in a period. Format YYYY-MM-DD:YYYY-MM-DD",
     )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="With --fetch-rates, number of days fetched at the same time (default 4)",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=2,
+        help="With --fetch-rates, maximum calls per second to remote sources, 0 for no limit "
+        "(default 2)",
+    )
+    parser.add_argument(
+        "--preload",
+        help="Check that the rates of all the days in a period, and of the currency given "
+        "with -c, can be loaded. Format YYYY-MM-DD:YYYY-MM-DD",
+    )
+    parser.add_argument(
+        "--strict",
+        action="store_true",
+        help="With --preload, fail if the rates of any day are missing",
+    )
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="Print the metrics of the rate lookups done, as JSON",
+    )
 
     args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.metrics:
+        metrics.enable()
 
     if args.create_table:
         print("Updating currency conversion cache database...")
         maybe_create_cache_table()
         print("Cache database updated successfully.")
 
+    if args.migrate:
+        print("Migrating currency conversion cache database...")
+        copied = migrate_cache_db(drop_legacy_table=args.drop_legacy_table)
+        print(f"Migrated {copied} rates.")
+
     if args.update_cache:
         print("Updating currency conversion cache database...")
-        fill_cache_db()
-        print("Cache database updated successfully.")
+        imported = fill_cache_db()
+        print(f"Cache database updated successfully, {imported} files imported.")
 
     if args.fetch_rates:
         from_dt, to_dt = args.fetch_rates.split(":")
-        fetch_period_rates(from_dt, to_dt)
+        fetch_period_rates(
+            from_dt, to_dt, concurrency=args.concurrency, rate_limit=args.rate_limit or None
+        )
+
+    if args.preload:
+        from_dt, to_dt = args.preload.split(":")
+        currencies = [Currency(args.currency.lower())] if args.currency else None
+        try:
+            report = preload(from_dt, to_dt, currencies, strict=args.strict)
+        except RuntimeError as e:
+            parser.exit(1, f"{e}\n")
+        print(
+            f"Loaded the rates of {report['loaded']} days, {report['fallback']} of them "
+            f"from earlier days"
+        )
+        if report["missing"]:
+            print("Missing: " + ", ".join(format_date(dt) for dt in report["missing"]))
+
+    if args.export_snapshot:
+        exported = export_snapshot(args.export_snapshot)
+        print(f"Exported the rates of {exported} dates to {args.export_snapshot}")
 
     rate_on_date = args.rate_on
     currency = args.currency
@@ -492,17 +2139,16 @@ def main():
             else:
                 print(f"Exchange rate not found for {currency} on {rate_on_date}")
         else:
-            with get_db_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT * FROM rates WHERE date = ?", (rate_on_date,))
-                row = cursor.fetchone()
-                if row:
-                    rates = {Currency(k.lower()): v for k, v in zip(row.keys()[1:], row[1:])}
-                    print(f"Exchange rates on {rate_on_date}:")
-                    for currency, rate in rates.items():
-                        print(f"{currency}: {repr(rate)}")
-                else:
-                    print(f"Exchange rates not found for {rate_on_date}")
+            rates = select_day_rates(parse_date(rate_on_date))
+            if rates:
+                print(f"Exchange rates on {rate_on_date}:")
+                for currency, rate in rates.items():
+                    print(f"{currency}: {repr(rate)}")
+            else:
+                print(f"Exchange rates not found for {rate_on_date}")
+
+    if args.metrics:
+        print(json.dumps(metrics.snapshot(), indent=2))
 
 
 if __name__ == "__main__":
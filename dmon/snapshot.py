@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+"""Binary snapshots of the rates cache.
+
+A snapshot is a file with a fixed-width array of float64 rates indexed
+by (date ordinal, currency), that is memory-mapped read-only: looking
+up the rates of a date does not parse anything, and all the processes
+that map the same file share its pages.
+
+Layout, little-endian:
+
+- header: magic b"DMONRATE", format version (u32), ordinal of the first
+  date (i32), number of dates (u32), number of currencies (u32);
+- the three-letter code of each currency, in column order, padded with
+  zeros to a multiple of 8 bytes;
+- the rates, one row of float64 per date and one column per currency,
+  with NaN for the rates that are missing;
+- one byte per rate, in the same order, that is 1 if the rate is the
+  shortest decimal that gives its float64 (its `repr`), as the rates
+  cached from text are, or 0 if it is the exact value of the float64,
+  as the rates cached as REAL are. Version 1 snapshots do not have
+  them, and all their rates are read as the exact value.
+"""
+
+import math
+import mmap
+import os
+import struct
+import sys
+from array import array
+from datetime import date
+from decimal import Decimal
+from typing import Dict, List, Mapping, Optional
+
+from dmon.currency import CURRENCY_CODES, Currency
+
+MAGIC = b"DMONRATE"
+VERSION = 2
+_HEADER = struct.Struct("<8sIiII")
+
+
+def write_snapshot(path: str, rows: Mapping[date, Mapping[Currency, Decimal]]) -> None:
+    """Writes the rates of `rows` to a snapshot file in `path`,
+    covering from its first to its last date. The file is replaced
+    atomically, so processes that have the old one mapped are not
+    affected."""
+    currencies: List[Currency] = list(Currency)
+    column = {currency: i for i, currency in enumerate(currencies)}
+    first = min(rows).toordinal() if rows else 0
+    n_days = max(rows).toordinal() - first + 1 if rows else 0
+
+    values = [math.nan] * (n_days * len(currencies))
+    decimal = bytearray(len(values))
+    for dt, rates in rows.items():
+        offset = (dt.toordinal() - first) * len(currencies)
+        for currency, rate in rates.items():
+            value = float(rate)
+            values[offset + column[currency]] = value
+            if Decimal(repr(value)).as_tuple() == rate.as_tuple():
+                decimal[offset + column[currency]] = 1
+
+    codes = b"".join(currency.value.encode("ascii") for currency in currencies)
+    codes += b"\0" * (-len(codes) % 8)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(_HEADER.pack(MAGIC, VERSION, first, n_days, len(currencies)))
+        file.write(codes)
+        file.write(struct.pack(f"<{len(values)}d", *values))
+        file.write(decimal)
+    os.replace(tmp_path, path)
+
+
+class RatesSnapshot:
+    """A snapshot file mapped read-only in memory."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.first_ordinal, self.n_days, n_currencies = _HEADER.unpack_from(
+            self._mmap
+        )
+        if magic != MAGIC or version not in (1, VERSION):
+            raise ValueError(f"{path} is not a rates snapshot")
+
+        codes_size = 3 * n_currencies
+        codes = self._mmap[_HEADER.size : _HEADER.size + codes_size].decode("ascii")
+        # Currencies unknown to this version are left out.
+        self.columns: Dict[int, Currency] = {
+            i: CURRENCY_CODES[codes[3 * i : 3 * i + 3]]
+            for i in range(n_currencies)
+            if codes[3 * i : 3 * i + 3] in CURRENCY_CODES
+        }
+        self.n_currencies = n_currencies
+
+        data_offset = _HEADER.size + codes_size + (-codes_size % 8)
+        n_values = self.n_days * n_currencies
+        data_end = data_offset + 8 * n_values
+        if sys.byteorder == "little":
+            self._values = memoryview(self._mmap)[data_offset:data_end].cast("d")
+        else:
+            # The rates are little-endian: big-endian hosts read a
+            # byte-swapped copy instead of the mapped pages.
+            values = array("d", self._mmap[data_offset:data_end])
+            values.byteswap()
+            self._values = memoryview(values)
+        if version == 1:
+            self._decimal = memoryview(bytes(n_values))
+        else:
+            self._decimal = memoryview(self._mmap)[data_end : data_end + n_values]
+
+    def __contains__(self, dt: date) -> bool:
+        return 0 <= dt.toordinal() - self.first_ordinal < self.n_days
+
+    def rates(self, dt: date) -> Optional[Dict[Currency, Decimal]]:
+        """Returns the rates of a date, or None if the snapshot does not
+        have them."""
+        if dt not in self:
+            return None
+        offset = (dt.toordinal() - self.first_ordinal) * self.n_currencies
+        values, decimal = self._values, self._decimal
+        rates = {
+            currency: (
+                Decimal(repr(values[offset + i]))
+                if decimal[offset + i]
+                else Decimal(values[offset + i])
+            )
+            for i, currency in self.columns.items()
+            if values[offset + i] == values[offset + i]  # not NaN
+        }
+        return rates or None
+
+    def close(self) -> None:
+        self._values.release()
+        self._decimal.release()
+        self._mmap.close()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+from decimal import Decimal as Dec
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from dmon.array import MoneyArray
+from dmon.currency import Currency
+from dmon.money import Money
+from dmon.rates import get_cross_rates
+
+
+date_a = "2022-07-14"
+date_b = "2022-01-07"
+
+
+def test_money_array_creation():
+    Eur = Money(Currency.EUR, date_a)
+
+    amounts = MoneyArray([10, 20.5, 30], ["€", "usd", Currency.AUD], money_class=Eur)
+    assert len(amounts) == 3
+    assert amounts[1] == Eur(20.5, "$")
+    assert amounts[1].currency == Currency.USD
+    assert list(amounts.cents()) == [1000, 2050, 3000]
+
+    # Round trip from and to money instances.
+    items = [Eur(10), Eur(20, "gbp", date_b), Eur(Dec("0.01"), "$")]
+    assert MoneyArray.from_money(items).to_money() == items
+    assert MoneyArray.from_money(items)[1].on_date == items[1].on_date
+
+
+def test_money_array_conversions():
+    Eur = Money(Currency.EUR, date_a)
+    Aud = Money(Currency.AUD, date_a)
+
+    amounts = MoneyArray(
+        [40, 40, 20], [Currency.EUR, Currency.EUR, "£"], [None, date_b, None], Eur
+    )
+    converted = amounts.to(Currency.AUD)
+    assert converted[0] == Aud(59.4)
+    assert converted[1] == Eur(40, on_date=date_b).to(Currency.AUD)
+    assert converted[2] == Eur(20, "£").to(Currency.AUD)
+    assert all(c == Currency.AUD for c in (m.currency for m in converted))
+
+    # The conversion factors are those kept by the rates of each date.
+    cross_rates = get_cross_rates(date_a)
+    assert (Currency.GBP, Currency.AUD) in cross_rates._factors
+
+    assert amounts.sum() == Eur(40) + Eur(40, on_date=date_b) + Eur(20, "£")
+    assert str(MoneyArray([20, 20], ["aud", "gbp"], money_class=Eur).sum()) == "€37.14"
+
+
+def test_money_array_operations():
+    Eur = Money(Currency.EUR, date_a)
+    Aud = Money(Currency.AUD, date_a)
+
+    a = MoneyArray([10, 20], "€", money_class=Eur)
+    b = MoneyArray([19.85, 10], "aud", money_class=Eur)
+
+    assert list(a + b) == [Eur(10) + Aud(19.85), Eur(20) + Aud(10)]
+    assert (a + b)[1] == Eur(26.73)
+    assert list(a - b) == [Eur(10) - Aud(19.85), Eur(20) - Aud(10)]
+    assert list(a + 1) == [Eur(11), Eur(21)]
+    assert list(a + Eur(2, "$")) == [Eur(10) + Eur(2, "$"), Eur(20) + Eur(2, "$")]
+    assert list(0.1 * a) == [Eur(1), Eur(2)]
+    assert list(a * np.array([1, 2])) == [Eur(10), Eur(40)]
+    assert list(-a) == [Eur(-10), Eur(-20)]
+
+    assert list(MoneyArray([40, 40.1], money_class=Eur) == Aud(59.4)) == [True, False]
+    assert list(a > b) == [False, True]
+    assert list(a >= b) == [False, True]
+    assert list(a < b) == [True, False]
+    assert list(a != b) == [True, True]
+
+
+def test_money_array_same_currency():
+    Eur = Money(Currency.EUR, date_a)
+
+    dollars = MoneyArray([1, 2], "$", [None, date_b], money_class=Eur)
+    total = dollars + MoneyArray([3, 4], ["$", "aud"], [None, date_b], money_class=Eur)
+    assert total[0] == Eur(4, "$") and total[0].currency == Currency.USD
+    assert total[1] == Eur(2, "$", date_b) + Eur(4, "aud", date_b)
+    assert total[1].currency == Currency.EUR
+    assert list(total) == [Eur(1, "$") + Eur(3, "$"), Eur(2, "$", date_b) + Eur(4, "aud", date_b)]
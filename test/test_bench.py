@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from bench import benchmarks
+
+
+def test_benchmarks_run_offline(capsys):
+    environment = dict(os.environ)
+    results = benchmarks.run_benchmarks(
+        ["money_add_cross_currency", "get_rates_miss", "find_rates_for_date_fallback"],
+        days=30,
+        repeat=2,
+        min_time=0.001,
+    )
+    assert os.environ == environment
+    assert set(results["benchmarks"]) == {
+        "money_add_cross_currency",
+        "get_rates_miss",
+        "find_rates_for_date_fallback",
+    }
+    assert all(r["best"] > 0 and r["repeat"] == 2 for r in results["benchmarks"].values())
+
+    slower = {
+        "benchmarks": {n: dict(r, best=2 * r["best"]) for n, r in results["benchmarks"].items()}
+    }
+    assert benchmarks.compare_results(results, results, threshold=1.2) == 0
+    assert benchmarks.compare_results(results, slower, threshold=1.2) == 3
+    assert "x2.00" in capsys.readouterr().out
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+import io
+from datetime import date
+
+import pytest
+
+from dmon import bulk
+from dmon.money import Money
+from dmon.currency import Currency
+
+date_a = "2022-07-14"
+
+
+RECORDS = """2022-07-14 USD 20.10
+EUR 20.00
+
+2022-01-07 A$ 1234c
+"""
+
+
+def test_parse_records():
+    Eur = Money(Currency.EUR, date_a)
+    parsed = list(bulk.parse_records(io.StringIO(RECORDS), Eur))
+    expected = [Eur.parse(line) for line in RECORDS.splitlines() if line]
+    assert [repr(m) for m in parsed] == [repr(m) for m in expected]
+    assert all(type(m) is Eur for m in parsed)
+    assert parsed[2].on_date == date(2022, 1, 7) and parsed[2].cents() == 1234
+
+    with pytest.raises(RuntimeError):
+        list(bulk.parse_records(["EUR 1", "2022-07-14 EUR 1 2"]))
+
+
+def test_parse_csv():
+    Eur = Money(Currency.EUR, date_a, backend="int")
+    lines = io.StringIO("id,date,amount,currency\n1,2022-07-14,20.10,usd\n2,,5,\n")
+    parsed = list(bulk.parse_csv(lines, money_class=Eur))
+    assert [repr(m) for m in parsed] == ["2022-07-14 USD 20.10", "EUR 5.00"]
+    assert parsed[0]._cents == Eur(20.10, "usd")._cents
+
+    parsed = list(bulk.parse_csv(["12.5;gbp"], amount=0, currency=1, on_date=None, delimiter=";"))
+    assert parsed[0].currency == Currency.GBP and parsed[0].cents() == 1250
+
+    with pytest.raises(RuntimeError):
+        bulk.parse_csv(["value,currency", "1,eur"])
+
+
+def test_parse_batches():
+    pytest.importorskip("numpy")
+
+    Eur = Money(Currency.EUR, date_a)
+    lines = (f"{date_a} {'EUR' if i % 2 else 'USD'} {i}.25" for i in range(10))
+    batches = list(bulk.parse_records(lines, Eur, batch_size=4))
+    assert [len(b) for b in batches] == [4, 4, 2]
+    assert batches[0][1] == Eur("1.25") and batches[2][0] == Eur("8.25", "usd")
+    assert sum(b.sum() for b in batches[1:]) + batches[0].sum() == sum(
+        bulk.parse_records(
+            (f"{date_a} {'EUR' if i % 2 else 'USD'} {i}.25" for i in range(10)), Eur
+        )
+    )
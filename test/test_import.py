@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import subprocess
+import sys
+
+
+# Seconds that `import dmon` may take, best of three runs in a fresh
+# interpreter.
+IMPORT_TIME_BUDGET = float(os.environ.get("DMON_IMPORT_TIME_BUDGET", "0.1"))
+
+HEAVY_MODULES = ("requests", "dateutil", "dotenv", "supabase", "numpy", "subprocess")
+
+_PROBE = f"""
+import json, sys, time
+start = time.perf_counter()
+import dmon
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed, "loaded": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+
+def probe_import():
+    output = subprocess.run(
+        [sys.executable, "-c", _PROBE],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output)
+
+
+def test_import_has_no_heavy_dependencies():
+    # Network clients, dotenv and subprocess are only imported when a
+    # remote source is used.
+    assert probe_import()["loaded"] == []
+
+
+def test_import_time_budget():
+    elapsed = min(probe_import()["elapsed"] for _ in range(3))
+    assert elapsed < IMPORT_TIME_BUDGET
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 
+import pytest
 from decimal import Decimal as Dec
 from dmon.money import Money
 from dmon.currency import Currency
@@ -164,3 +165,127 @@ def test_repr():
     # same as a pound in date_a
     assert Eur.parse("2023-10-20 GBP 20.00") != Eur(20, "£")
     assert Eur.parse("2023-10-20 GBP 20.00") == Eur(20, "£", "2023-10-20")
+
+
+def test_compact_instances():
+    Eur = Money(Currency.EUR, date_a)
+
+    # Instances have no __dict__, and results of operations are built
+    # directly from their normalized values.
+    assert not hasattr(Eur(10), "__dict__")
+    with pytest.raises(AttributeError):
+        Eur(10).other = 1
+
+    result = Eur(10, "$") + Eur(20, "CAD")
+    assert type(result) is Eur
+    assert result.currency == Currency.EUR and result.on_date == Eur.base_date
+    assert (-Eur(10, "$")).currency == Currency.USD
+    assert Eur(10).on(date_b).on_date == Money("€", date_b).base_date
+    assert Eur(10).to("$").currency == Currency.USD
+    assert (Eur(10) * 3).cents() == 3000
+
+
+def test_same_currency_operations():
+    Eur = Money(Currency.EUR, date_a)
+    OldEur = Money("€", date_b)
+
+    # Amounts in the same currency and date are added exactly, and keep
+    # their currency.
+    total = Eur("10.01", "$") + Eur("20.02", "$")
+    assert total.currency == Currency.USD and total.cents() == Dec("3003")
+    assert total.on_date == Eur.base_date
+    assert total == Eur(10.01, "$") + Eur(20.02, "CAD") - Eur(20.02, "CAD") + Eur(20.02, "$")
+    assert (Eur(30, "$", date_b) - Eur(10, "$", date_b)).on_date.isoformat() == date_b
+
+    # Otherwise they are converted to the base currency.
+    assert (Eur(10, "$") + Eur(10, "$", date_b)).currency == Currency.EUR
+    assert (Eur(10, "$") + OldEur(10, "$")).currency == Currency.EUR
+    assert (Eur(10) + OldEur(10)).on_date == Eur.base_date
+
+    assert Eur(10, "$") < Eur(10.01, "$")
+    assert Eur(10, "$") <= Eur(10, "$") and Eur(10, "$") >= Eur(10, "$")
+    assert not Eur(10, "$") > Eur(10, "$", date_b) * 2
+
+
+def test_int_backend():
+    Eur = Money(Currency.EUR, date_a)
+    IntEur = Money(Currency.EUR, date_a, backend="int", scale=4)
+    assert IntEur.scale == 4 and Eur.scale is None
+
+    # Amounts are stored as ints, and conversions are rounded to the scale.
+    assert IntEur(40)._cents == 40000000
+    assert IntEur(40).cents() == Dec(4000)
+    assert IntEur(40).cents("usd") == Dec("4020.1005")
+    assert IntEur(40).to("usd")._cents == 40201005
+    assert str(IntEur(40).to(Currency.INR)) == str(Eur(40).to(Currency.INR))
+
+    assert IntEur(10) + IntEur(20) == IntEur(30)
+    assert IntEur("0.1") * 3 == IntEur("0.3")
+    assert IntEur(10) / 3 == IntEur("3.333333")
+    assert IntEur(10) / IntEur(20, "eur") == Dec("0.5")
+    assert IntEur(20.1, "$") == IntEur(20) == Eur(20)
+    assert Eur(20, "$") + IntEur(20, "$") == Eur(40, "$")
+    assert IntEur(20.1, "$") <= IntEur(20) < IntEur(-1, "$") + IntEur(21)
+    assert sum([IntEur(1, "$"), IntEur(2, "$")], IntEur(0, "$")) == IntEur(3, "$")
+
+    with pytest.raises(ValueError):
+        Money(Currency.EUR, backend="float")
+
+
+def test_ledger():
+    from dmon import Ledger
+
+    Eur = Money(Currency.EUR, date_a)
+    OldEur = Money(Currency.EUR, date_b)
+    items = [Eur(10), Eur(20, "usd"), Eur(30, "usd"), Eur(5), OldEur(7, "aud"), Eur(1, "aud")]
+
+    ledger = Ledger(Eur, items)
+    assert len(ledger) == 4
+    assert ledger.total() == sum(items, Eur(0))
+    assert ledger.total().currency == Currency.EUR
+    assert ledger.total("usd") == sum(items, Eur(0)).to("usd")
+    assert sorted(str(m) for m in ledger.subtotals()) == ["$50.00", "A$1.00", "A$7.00", "€15.00"]
+
+    # Amounts of other backends are kept in the representation of the ledger.
+    IntEur = Money(Currency.EUR, date_a, backend="int")
+    ledger += IntEur(5)
+    ledger += Ledger(items=[Eur(1, "usd")])
+    assert ledger.total() == sum(items, Eur(5)) + Eur(1, "usd")
+
+    int_ledger = Ledger(items=[IntEur(10), IntEur(20, "usd"), IntEur(30, "usd")])
+    assert int_ledger.money_class is IntEur
+    assert int_ledger.total()._cents == IntEur(10)._cents + IntEur(50, "usd").to("eur")._cents
+
+
+def test_sqlite():
+    import sqlite3
+    from dmon.money import register_sqlite
+
+    Eur = Money(Currency.EUR, date_a)
+    IntEur = Money(Currency.EUR, date_a, backend="int")
+    amounts = [Eur(40).to("usd"), Eur("1234c", "gbp", date_b), Eur(-5)]
+
+    assert amounts[2].encode() == "eur:0:-500"
+    assert Eur.decode(amounts[1].encode().encode()) == amounts[1]
+
+    with sqlite3.connect(":memory:", detect_types=sqlite3.PARSE_DECLTYPES) as conn:
+        conn.execute("CREATE TABLE payments (id INTEGER, amount MONEY)")
+        # Unregistered classes are written as their repr, and read back too.
+        conn.execute("INSERT INTO payments VALUES (0, ?)", (Eur(20, "usd", date_b),))
+        register_sqlite(Eur)
+        conn.executemany("INSERT INTO payments VALUES (?, ?)", enumerate(amounts, 1))
+
+        stored = [row[0] for row in conn.execute("SELECT CAST(amount AS TEXT) FROM payments")]
+        assert stored[:2] == ["2022-01-07 USD 20.00", "usd:0:4020.100502512562832012897042"]
+
+        read = [row[0] for row in conn.execute("SELECT amount FROM payments ORDER BY id")]
+        assert all(type(m) is Eur for m in read)
+        assert repr(read[0]) == repr(Eur(20, "usd", date_b))
+        assert [m.cents() for m in read[1:]] == [m.cents() for m in amounts]
+        assert [m.on_date for m in read[1:]] == [m.on_date for m in amounts]
+
+        register_sqlite(IntEur, "INTMONEY")
+        conn.execute("CREATE TABLE totals (amount INTMONEY)")
+        conn.execute("INSERT INTO totals VALUES (?)", (IntEur(40).to("usd"),))
+        (total,) = conn.execute("SELECT amount FROM totals").fetchone()
+        assert type(total) is IntEur and total.cents() == Dec("4020.1005")
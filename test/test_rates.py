@@ -0,0 +1,809 @@
+# -*- coding: utf-8 -*-
+
+import os
+from datetime import date, timedelta
+from decimal import Decimal as Dec
+from contextlib import contextmanager
+
+import pytest
+
+from dmon import rates
+from dmon.currency import Currency
+
+date_a = "2022-07-14"
+date_b = "2022-01-07"
+
+
+@pytest.fixture(autouse=True)
+def fresh_rates_cache():
+    rates.clear_rates_cache()
+    rates.RATE_RESOLUTIONS.clear()
+    yield
+    rates.clear_rates_cache()
+    rates.RATE_RESOLUTIONS.clear()
+
+
+@pytest.fixture
+def tmp_cache(monkeypatch, tmp_path):
+    """Points the sqlite cache to an empty database."""
+    rates.close_db_connections()
+    monkeypatch.setenv("DMON_RATES_CACHE", str(tmp_path))
+    yield tmp_path
+    rates.close_db_connections()
+
+
+@pytest.fixture
+def sources(monkeypatch):
+    """Replaces the rate sources with ones that only know about date_a,
+    and counts how many times they are called."""
+    calls = []
+
+    def from_repo(on_date):
+        calls.append(rates.format_date(on_date))
+        if rates.format_date(on_date) == date_a:
+            return {"USD": 1, "EUR": 0.995, "AUD": 1.4776}
+        return None
+
+    monkeypatch.setattr(rates, "get_day_rates_from_repo", from_repo)
+    monkeypatch.setattr(rates, "get_day_rates_from_supabase", lambda on_date: None)
+    monkeypatch.setattr(rates, "get_rates_range_from_supabase", lambda *args, **kwargs: {})
+    monkeypatch.delenv("DMON_EXCHANGERATE_API_KEY", raising=False)
+    return calls
+
+
+def test_rates_cache_serves_repeated_lookups(monkeypatch):
+    assert rates.get_rates(date_a, Currency.EUR, Currency.USD) == {
+        Currency.EUR: Dec(0.995),
+        Currency.USD: Dec(1),
+    }
+    assert date.fromisoformat(date_a) in rates.RATES_CACHE
+
+    # Once cached, the full row is available without touching sqlite.
+    @contextmanager
+    def no_db(*args, **kwargs):
+        raise AssertionError("sqlite should not be queried")
+        yield
+
+    monkeypatch.setattr(rates, "get_db_connection", no_db)
+    assert rates.get_rate(date_a, Currency.AUD) == Dec(1.4776)
+    assert len(rates.get_rates(date_a)) > 100
+
+
+def test_rates_cache_eviction():
+    cache = rates.RatesCache(maxsize=2)
+    d1, d2, d3 = date(2022, 1, 1), date(2022, 1, 2), date(2022, 1, 3)
+    cache.put(d1, {Currency.USD: Dec(1)})
+    cache.put(d2, {Currency.USD: Dec(2)})
+
+    # Using d1 makes d2 the least recently used entry.
+    assert cache.get(d1) == {Currency.USD: Dec(1)}
+    cache.put(d3, {Currency.USD: Dec(3)})
+    assert d2 not in cache
+    assert d1 in cache and d3 in cache
+
+    cache.resize(1)
+    assert len(cache) == 1 and d3 in cache
+
+    cache.resize(0)
+    cache.put(d1, {Currency.USD: Dec(1)})
+    assert len(cache) == 0
+
+
+def test_cross_rates():
+    cross_rates = rates.get_cross_rates(date_a)
+    assert cross_rates is rates.get_cross_rates(date.fromisoformat(date_a))
+
+    # Conversions give exactly the same results as the individual rates.
+    eur, aud = rates.get_rates(date_a, Currency.EUR, Currency.AUD).values()
+    assert cross_rates.convert(Dec(4000), Currency.EUR, Currency.AUD) == Dec(4000) * aud / eur
+    assert cross_rates.convert(Dec(4000), Currency.EUR, Currency.EUR) == Dec(4000)
+
+    assert cross_rates.factor(Currency.EUR, Currency.AUD) == aud / eur
+    assert cross_rates.precompute().factor(Currency.AUD, Currency.EUR) == eur / aud
+
+    with pytest.raises(RuntimeError):
+        rates.CrossRates(date.fromisoformat(date_a), {}).convert(
+            Dec(1), Currency.EUR, Currency.AUD
+        )
+
+
+def test_fallback_resolutions_are_remembered(tmp_cache, sources):
+    # 2022-07-16 has no rates; the two days before are walked until date_a.
+    assert rates.get_rate("2022-07-16", Currency.EUR) == Dec("0.995")
+    assert sources == ["2022-07-16", "2022-07-15", date_a]
+
+    # Neither the in-process caches nor the sources are needed to
+    # resolve it again: the resolution is stored in the cache database.
+    rates.clear_rates_cache()
+    rates.RATE_RESOLUTIONS.clear()
+    assert rates.get_cross_rates("2022-07-16").on_date == date.fromisoformat(date_a)
+    assert len(sources) == 3
+
+
+def test_missing_rates_are_remembered(tmp_cache, sources, monkeypatch):
+    assert rates.get_rates("2022-07-01", Currency.EUR) is None
+    assert len(sources) == 10
+
+    rates.RATE_RESOLUTIONS.clear()
+    assert rates.get_rates("2022-07-01", Currency.EUR) is None
+    assert len(sources) == 10
+
+    # Once the resolution expires the sources are queried again.
+    monkeypatch.setattr(rates.RATE_RESOLUTIONS, "missing_ttl", -1)
+    assert rates.get_rates("2022-07-01", Currency.EUR) is None
+    assert len(sources) == 20
+
+
+def test_rates_range(tmp_cache, sources):
+    rates.cache_day_rates(date_a, {"USD": 1, "EUR": 0.995, "AUD": 1.4776})
+    rates.cache_day_rates("2022-07-18", {"USD": 1, "EUR": 0.98, "AUD": 1.45})
+
+    period = rates.get_rates_range(date_a, "2022-07-18", Currency.EUR)
+    assert list(period) == [date(2022, 7, d) for d in range(14, 19)]
+    assert period[date(2022, 7, 18)] == {Currency.EUR: Dec("0.98")}
+
+    # The days in between fall back to the rates of date_a.
+    assert all(period[date(2022, 7, d)] == {Currency.EUR: Dec("0.995")} for d in range(14, 18))
+    assert "2022-07-18" not in sources and date_a in sources
+
+    rates.clear_rates_cache()
+    assert period == {
+        dt: rates.get_rates(dt, Currency.EUR) for dt in rates.get_rates_range(date_a, "2022-07-18")
+    }
+
+
+def test_migrate_cache_db(tmp_cache, sources):
+    import shutil
+    import sqlite3
+
+    # A database created by earlier versions only has the wide table.
+    shutil.copy("test/res/exchange-rates.db", tmp_cache / "exchange-rates.db")
+    legacy = rates.get_rates(date_a, Currency.EUR, Currency.AUD)
+    legacy_period = rates.select_rates_range(date(2000, 1, 1), date(2030, 1, 1))
+    assert len(legacy_period) == 3
+
+    assert rates.migrate_cache_db() == sum(len(r) for r in legacy_period.values())
+    rates.clear_rates_cache()
+    assert rates.get_rates(date_a, Currency.EUR, Currency.AUD) == legacy
+
+    assert rates.migrate_cache_db(drop_legacy_table=True) == 0
+    assert rates.select_rates_range(date(2000, 1, 1), date(2030, 1, 1)) == legacy_period
+    assert sources == []
+
+    with sqlite3.connect(tmp_cache / "exchange-rates.db") as conn:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+        assert "rates" not in tables and "rate_values" in tables
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_connection_pool_threads(tmp_cache):
+    from concurrent.futures import ThreadPoolExecutor
+
+    def write_and_read(day):
+        rates.cache_day_rates(date(2022, 7, day), {"USD": 1, "EUR": day / 100})
+        with rates.get_db_connection() as conn:
+            assert conn is rates.get_connection_pool().reader()
+        return rates.select_day_rates(date(2022, 7, day))[Currency.EUR]
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(write_and_read, range(1, 29)))
+    assert results == [Dec(str(day / 100)) for day in range(1, 29)]
+
+    # Each thread reads with its own connection, kept open between calls.
+    pool = rates.get_connection_pool()
+    assert 1 <= len(pool._readers) <= 4
+    with rates.get_db_connection() as first, rates.get_db_connection() as second:
+        assert first is second
+
+
+def test_fetch_period_rates(tmp_cache, sources):
+    rates.cache_day_rates(date_a, {"USD": 1, "EUR": 0.995})
+
+    summary = rates.fetch_period_rates("2022-07-13", "2022-07-17", concurrency=3)
+    assert summary == {"skipped": 1, "fetched": 3, "missing": 1}
+    assert rates.select_cached_dates(date(2022, 7, 1), date(2022, 7, 31)) == {
+        date.fromisoformat(date_a)
+    }
+
+    # Days that were fetched or resolved are not fetched again.
+    calls = len(sources)
+    rates.RATE_RESOLUTIONS.clear()
+    assert rates.fetch_period_rates("2022-07-13", "2022-07-17")["skipped"] == 5
+    assert len(sources) == calls
+    assert rates.REMOTE_RATE_LIMITER is None
+
+
+def test_token_bucket():
+    import threading
+    import time
+
+    bucket = rates.TokenBucket(rate=100, capacity=2)
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+
+    # The first two calls use the burst, the other four wait 10ms each.
+    assert time.monotonic() - start >= 0.035
+
+    # A thread limit applies to the calls of that thread only.
+    calls = []
+
+    class Limiter:
+        def acquire(self):
+            calls.append(threading.get_ident())
+
+    with rates.thread_rate_limit(Limiter()):
+        rates.throttle_remote()
+        other = threading.Thread(target=rates.throttle_remote)
+        other.start()
+        other.join()
+    rates.throttle_remote()
+    assert calls == [threading.get_ident()]
+
+
+def test_fill_cache_db(tmp_cache, tmp_path, monkeypatch):
+    import os
+    import shutil
+
+    repo = tmp_path / "repo"
+    shutil.copytree("test/res/money", repo / "money")
+    monkeypatch.setenv("DMON_RATES_REPO", str(repo))
+
+    assert rates.fill_cache_db(workers=2) == 3
+    assert rates.select_cached_dates(date(2022, 1, 1), date(2023, 12, 31)) == {
+        date(2022, 1, 7),
+        date(2022, 7, 14),
+        date(2023, 10, 20),
+    }
+    assert rates.get_rate(date_a, Currency.EUR) == Dec("0.995")
+
+    # Only files that changed are imported again.
+    assert rates.fill_cache_db() == 0
+    rates_file = repo / "money" / f"{date_a}-rates.json"
+    os.utime(rates_file, (0, 0))
+    assert rates.fill_cache_db() == 0
+
+    rates_file.write_text('{"conversion_rates": {"USD": 1, "EUR": 0.99, "XXX": 2}}')
+    assert rates.fill_cache_db() == 1
+    assert rates.get_rates(date_a) == {Currency.USD: Dec(1), Currency.EUR: Dec("0.99")}
+    assert rates.fill_cache_db(force=True) == 3
+
+
+def test_rates_snapshot(tmp_cache, monkeypatch):
+    import shutil
+
+    shutil.copy("test/res/exchange-rates.db", tmp_cache / "exchange-rates.db")
+    path = str(tmp_cache / "rates.snapshot")
+    assert rates.export_snapshot(path) == 3
+
+    snapshot = rates.load_snapshot(path)
+    try:
+        assert date.fromisoformat(date_b) in snapshot
+        assert date(2022, 7, 15) in snapshot and snapshot.rates(date(2022, 7, 15)) is None
+        assert date(2023, 10, 21) not in snapshot
+        for dt in (date_a, date_b, "2023-10-20"):
+            assert snapshot.rates(date.fromisoformat(dt)) == rates.select_day_rates(
+                date.fromisoformat(dt)
+            )
+
+        # With a snapshot loaded the sqlite cache is not needed.
+        monkeypatch.setattr(rates, "load_day_rates", None)
+        assert rates.get_rate(date_a, Currency.EUR) == Dec(0.995)
+    finally:
+        rates.load_snapshot(None)
+
+
+def test_rates_snapshot_of_text_rates(tmp_cache):
+    from dmon.money import Money
+
+    rates.cache_day_rates(date_a, {"USD": 1, "EUR": 0.995, "AED": 3.6725, "AUD": 1.4776})
+    Eur = Money(Currency.EUR)
+    without = rates.get_rates(date_a)
+    cents = Eur(100, "usd", date_a).cents("eur")
+    assert cents == Dec("9950.000")
+
+    path = str(tmp_cache / "rates.snapshot")
+    rates.export_snapshot(path)
+    rates.load_snapshot(path)
+    rates.clear_rates_cache()
+    try:
+        # Same values, with the same exponents.
+        assert {c: str(r) for c, r in rates.get_rates(date_a).items()} == {
+            c: str(r) for c, r in without.items()
+        }
+        assert str(Eur(100, "usd", date_a).cents("eur")) == str(cents)
+    finally:
+        rates.load_snapshot(None)
+
+
+def test_metrics(tmp_cache, sources, monkeypatch):
+    from dmon import metrics
+
+    # Nothing is recorded while disabled.
+    metrics.reset()
+    rates.get_rate(date_a, Currency.EUR)
+    assert metrics.snapshot() == {"counters": {}, "histograms": {}}
+
+    events = []
+    monkeypatch.setattr(metrics, "ENABLED", True)
+    metrics.add_exporter(lambda *event: events.append(event))
+    try:
+        rates.clear_rates_cache()
+        assert rates.get_rate("2022-07-16", Currency.EUR) == Dec("0.995")
+        assert rates.get_rate("2022-07-16", Currency.AUD) == Dec("1.4776")
+        snapshot = metrics.snapshot()
+    finally:
+        metrics.remove_exporter(metrics.METRICS.exporters[-1])
+        metrics.reset()
+
+    counters, histograms = snapshot["counters"], snapshot["histograms"]
+    assert counters["rates.cache.miss"] == 1 and counters["rates.cache.hit"] == 1
+    assert counters["source.repo.found"] == 1
+    assert histograms["source.repo"]["count"] == 3
+    assert histograms["source.supabase_range"]["count"] == 1
+    assert histograms["fallback.depth"]["buckets"]["2"] == 1
+    assert histograms["db.select_day_rates"]["count"] >= 1
+    assert ("counter", "rates.cache.hit", 1) in events
+
+
+class FakeSupabase:
+    """Stand-in for a Supabase client whose database has the rates of
+    `days`, with the get_rates_for_date function and, if `ranges`, the
+    get_rates_for_date_range function."""
+
+    def __init__(self, days, ranges=True):
+        self.days = days
+        self.ranges = ranges
+        self.calls = []
+
+    def rpc(self, name, params):
+        self.calls.append(name)
+        if name == "get_rates_for_date":
+            data = self.days.get(params["target_date"])
+            data = {"conversion_rates": data} if data else None
+        elif name == "get_rates_for_date_range" and self.ranges:
+            data = [
+                {"date": day, "conversion_rates": day_rates}
+                for day, day_rates in sorted(self.days.items())
+                if params["start_date"] <= day <= params["end_date"]
+            ]
+        else:
+            raise RuntimeError(f"Could not find the function {name}")
+
+        class Response:
+            def execute(self):
+                self.data = data
+                return self
+
+        return Response()
+
+
+@pytest.fixture
+def supabase(monkeypatch):
+    """Serves the rates of date_a from a fake Supabase client, and
+    nothing from the repository."""
+    monkeypatch.setattr(rates, "get_day_rates_from_repo", lambda on_date: None)
+    monkeypatch.delenv("DMON_RATES_REPO")
+    monkeypatch.delenv("DMON_EXCHANGERATE_API_KEY", raising=False)
+    client = FakeSupabase({date_a: {"USD": 1, "EUR": 0.995}})
+    rates.set_supabase_client(client)
+    yield client
+    rates.set_supabase_client(None)
+
+
+def test_supabase_client_is_reused(supabase):
+    assert rates.get_supabase_client() is supabase
+    assert rates.get_day_rates_from_supabase(date_a) == {"USD": 1, "EUR": 0.995}
+    assert rates.get_day_rates_from_supabase("2022-07-15") is None
+    assert rates.get_supabase_client() is supabase
+
+
+def test_supabase_range(tmp_cache, supabase):
+    # The whole fallback window is fetched in a single call.
+    assert rates.find_rates_for_date("2022-07-16") == (
+        {"USD": 1, "EUR": 0.995},
+        date.fromisoformat(date_a),
+    )
+    assert supabase.calls == ["get_rates_for_date_range"]
+
+    supabase.calls.clear()
+    summary = rates.fetch_period_rates("2022-07-13", "2022-07-14")
+    assert summary == {"skipped": 0, "fetched": 1, "missing": 1}
+    assert supabase.calls == ["get_rates_for_date_range", "get_rates_for_date_range"]
+
+    # Without the range function the dates are fetched one by one.
+    supabase.ranges = False
+    supabase.calls.clear()
+    assert rates.get_rates_range_from_supabase(date_a, "2022-07-16") == {
+        date.fromisoformat(date_a): {"USD": 1, "EUR": 0.995}
+    }
+    assert rates.get_rates_range_from_supabase(date_a, date_a, fallback=False) is None
+    assert supabase.calls.count("get_rates_for_date") == 3
+
+    # Nor is it called again.
+    supabase.calls.clear()
+    assert rates.find_rates_for_date("2022-07-15")[1] == date.fromisoformat(date_a)
+    assert rates.find_rates_for_date("2022-07-15")[1] == date.fromisoformat(date_a)
+    assert supabase.calls == ["get_rates_for_date"] * 4
+
+
+def test_fetch_period_rates_prefers_the_repo(tmp_cache, tmp_path, monkeypatch):
+    import shutil
+
+    repo = tmp_path / "repo"
+    shutil.copytree("test/res/money", repo / "money")
+    monkeypatch.setenv("DMON_RATES_REPO", str(repo))
+    monkeypatch.delenv("DMON_EXCHANGERATE_API_KEY", raising=False)
+    sync = rates.RepoSync(interval=3600)
+    monkeypatch.setattr(sync, "_pull", lambda repo_dir: None)
+    monkeypatch.setattr(rates, "REPO_SYNC", sync)
+
+    client = FakeSupabase({date_a: {"USD": 1, "EUR": 0.5}, "2022-07-15": {"USD": 1, "EUR": 0.99}})
+    rates.set_supabase_client(client)
+    try:
+        summary = rates.fetch_period_rates(date_a, "2022-07-15")
+    finally:
+        rates.set_supabase_client(None)
+
+    # The day in the repository is not taken from Supabase.
+    assert summary == {"skipped": 0, "fetched": 2, "missing": 0}
+    assert client.calls == ["get_rates_for_date_range"]
+    assert rates.get_rate(date_a, Currency.EUR) == Dec("0.995")
+    assert rates.get_rate("2022-07-15", Currency.EUR) == Dec("0.99")
+
+
+@pytest.fixture
+def exchangerate_api(monkeypatch):
+    """Serves a stand-in of exchangerate-api on localhost. Paths that
+    contain "busy" answer 429 once, asking to retry after "slow" ones
+    after an hour and the others right away."""
+    import json
+    import threading
+    import time
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    requests_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_seen.append(self.path)
+            if "busy" in self.path and self.path not in requests_seen[:-1]:
+                self.send_response(429)
+                self.send_header("Retry-After", "3600" if "slow" in self.path else "0")
+                self.end_headers()
+                return
+            body = json.dumps(
+                {
+                    "conversion_rates": {"USD": 1, "EUR": 0.995},
+                    "time_next_update_unix": int(time.time()) + 3600,
+                }
+            ).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("DMON_EXCHANGERATE_API_URL", f"http://127.0.0.1:{server.server_port}/v6")
+    monkeypatch.setenv("DMON_EXCHANGERATE_API_KEY", "key")
+    monkeypatch.setenv("NO_PROXY", "127.0.0.1")
+    rates.set_http_session(None)
+    rates.LATEST_RATES.clear()
+    yield requests_seen
+    server.shutdown()
+    server.server_close()
+    rates.set_http_session(None)
+    rates.LATEST_RATES.clear()
+
+
+def test_exchangerate_api(exchangerate_api, monkeypatch):
+    import time
+
+    # Today's rates are fetched once, until their next update.
+    for _ in range(3):
+        assert rates.fetch_rates_from_exchangerate_api(date.today()) == {"USD": 1, "EUR": 0.995}
+    assert exchangerate_api == ["/v6/key/latest/USD"]
+
+    assert rates.fetch_rates_from_exchangerate_api(date_a)["EUR"] == 0.995
+    assert exchangerate_api[-1] == "/v6/key/history/USD/2022/07/14"
+
+    # Too many requests are retried, on the same session.
+    session = rates.get_http_session()
+    exchangerate_api.clear()
+    monkeypatch.setenv("DMON_EXCHANGERATE_API_KEY", "busy")
+    assert rates.fetch_rates_from_exchangerate_api(date_a)["USD"] == 1
+    assert exchangerate_api == ["/v6/busy/history/USD/2022/07/14"] * 2
+    assert rates.get_http_session() is session
+
+    # Without waiting longer than DMON_HTTP_MAX_RETRY_AFTER seconds.
+    monkeypatch.setenv("DMON_HTTP_MAX_RETRY_AFTER", "0.1")
+    monkeypatch.setenv("DMON_EXCHANGERATE_API_KEY", "busy-slow")
+    rates.set_http_session(None)
+    start = time.monotonic()
+    assert rates.fetch_rates_from_exchangerate_api(date_a)["USD"] == 1
+    assert time.monotonic() - start < 5
+
+
+def test_repo_sync(tmp_path, monkeypatch):
+    import shutil
+    import time
+
+    repo = tmp_path / "repo"
+    shutil.copytree("test/res/money", repo / "money")
+    monkeypatch.setenv("DMON_RATES_REPO", str(repo))
+    monkeypatch.setattr(rates, "get_rates_range_from_supabase", lambda *args, **kwargs: {})
+    monkeypatch.delenv("DMON_EXCHANGERATE_API_KEY", raising=False)
+
+    sync = rates.RepoSync(interval=3600)
+    pulls = []
+    monkeypatch.setattr(sync, "_pull", pulls.append)
+    monkeypatch.setattr(rates, "REPO_SYNC", sync)
+
+    # The fallback walk pulls once, not once per missing day.
+    assert rates.find_rates_for_date("2022-07-16")[1] == date.fromisoformat(date_a)
+    assert rates.find_rates_for_date("2022-07-17")[1] == date.fromisoformat(date_a)
+    assert pulls == [str(repo)]
+
+    # Files added to the repository are found without pulling.
+    shutil.copy(repo / "money" / f"{date_a}-rates.json", repo / "money" / "2022-07-17-rates.json")
+    assert rates.find_rates_for_date("2022-07-17")[1] == date(2022, 7, 17)
+    assert date(2022, 7, 17) in sync.dates(str(repo))
+
+    sync.interval = 0
+    assert rates.get_day_rates_from_repo("2022-07-18") is None
+    assert len(pulls) == 2
+
+    # In the background the repository is only pulled by the thread.
+    sync.interval = 3600
+    sync.start()
+    try:
+        for _ in range(100):
+            if len(pulls) == 3:
+                break
+            time.sleep(0.01)
+        assert rates.get_day_rates_from_repo("2022-07-18") is None
+        assert len(pulls) == 3
+    finally:
+        sync.stop()
+
+    # Lookups that wait for the pull of another thread see its files.
+    from concurrent.futures import ThreadPoolExecutor
+
+    days = ["2022-07-20", "2022-07-21"]
+
+    def slow_pull(repo_dir):
+        time.sleep(0.1)
+        for day in days:
+            shutil.copy(
+                repo / "money" / f"{date_a}-rates.json", repo / "money" / f"{day}-rates.json"
+            )
+
+    sync = rates.RepoSync(interval=3600)
+    monkeypatch.setattr(sync, "_pull", slow_pull)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        found = executor.map(lambda day: sync.has(str(repo), date.fromisoformat(day)), days)
+        assert list(found) == [True, True]
+
+
+def test_preload(tmp_cache, sources, monkeypatch):
+    rates.cache_day_rates(date_a, {"USD": 1, "EUR": 0.995, "AUD": 1.4776})
+
+    report = rates.preload(date_a, "2022-07-16", [Currency.EUR])
+    assert report == {"loaded": 3, "fallback": 2, "missing": []}
+    assert rates.RATES_CACHE.pinned() == {date(2022, 7, d) for d in (14, 15, 16)}
+
+    # Pinned dates are not evicted, and need neither sqlite nor the sources.
+    load_day_rates = rates.load_day_rates
+    rates.set_rates_cache_size(0)
+    monkeypatch.setattr(rates, "load_day_rates", None)
+    try:
+        assert rates.get_rate("2022-07-16", Currency.AUD) == Dec("1.4776")
+    finally:
+        rates.set_rates_cache_size(1024)
+        monkeypatch.setattr(rates, "load_day_rates", load_day_rates)
+
+    with pytest.raises(RuntimeError):
+        rates.preload("2022-07-12", date_a, strict=True)
+    assert len(rates.RATES_CACHE.pinned()) == 3
+
+    report = rates.preload(date_a, "2022-07-15", (c for c in [Currency.EUR, Currency.GBP]))
+    assert report["missing"] == [date(2022, 7, 14), date(2022, 7, 15)]
+
+    rates.RATES_CACHE.unpin()
+    assert rates.RATES_CACHE.pinned() == set() and len(rates.RATES_CACHE) == 3
+
+
+def test_concurrent_misses_fetch_once(tmp_cache, sources, monkeypatch):
+    import threading
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    from_repo = rates.get_day_rates_from_repo
+    barrier = threading.Barrier(8)
+
+    def slow_repo(on_date):
+        time.sleep(0.05)
+        return from_repo(on_date)
+
+    def convert(_):
+        barrier.wait()
+        return rates.get_rate(date_a, Currency.EUR)
+
+    monkeypatch.setattr(rates, "get_day_rates_from_repo", slow_repo)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert list(executor.map(convert, range(8))) == [Dec("0.995")] * 8
+    assert sources == [date_a]
+
+    # Errors reach all the waiting threads.
+    calls = []
+
+    def failing_repo(on_date):
+        calls.append(on_date)
+        time.sleep(0.05)
+        raise OSError("unavailable")
+
+    def load(_):
+        barrier.wait()
+        return rates.load_day_rates(date(2022, 7, 20))
+
+    monkeypatch.setattr(rates, "get_day_rates_from_repo", failing_repo)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(load, None) for _ in range(8)]
+    assert all(isinstance(f.exception(), OSError) for f in futures)
+    assert len(calls) == 1
+
+
+def test_fetch_locks(tmp_cache, sources, monkeypatch):
+    import sqlite3
+    import threading
+    import time
+
+    monkeypatch.setattr(rates, "FETCH_LOCKS", rates.FetchLocks(True, ttl=60, poll_interval=0.01))
+    dt = date.fromisoformat(date_a)
+
+    # Another process holds the lock of the date, and caches its rates.
+    other = rates.FETCH_LOCKS.acquire(dt)
+    assert other is not None and rates.FETCH_LOCKS.acquire(dt) is None
+
+    def other_process():
+        time.sleep(0.1)
+        rates.cache_day_rates(dt, {"USD": 1, "EUR": 0.995})
+        rates.FETCH_LOCKS.release(dt, other)
+
+    thread = threading.Thread(target=other_process)
+    thread.start()
+    assert rates.load_day_rates(dt)[1] == dt
+    thread.join()
+    assert sources == []
+
+    # Locks of processes that died expire.
+    day = "2022-07-16"
+    with sqlite3.connect(tmp_cache / "exchange-rates.db") as conn:
+        conn.execute("INSERT INTO fetch_locks VALUES (?, 'dead', ?)", (day, time.time() - 1))
+    assert rates.load_day_rates(date.fromisoformat(day))[1] == dt
+    assert sources == [day, "2022-07-15", date_a]
+    with sqlite3.connect(tmp_cache / "exchange-rates.db") as conn:
+        assert conn.execute("SELECT COUNT(*) FROM fetch_locks").fetchone()[0] == 0
+
+
+def test_today_refresher(tmp_cache, sources, monkeypatch):
+    import time
+
+    today = [date(2022, 7, 16)]
+    refresher = rates.TodayRefresher(interval=60, serve_stale=True, clock=lambda: today[0])
+    monkeypatch.setattr(rates, "TODAY_REFRESHER", refresher)
+
+    # Until today's rates are published, those of the latest day are
+    # served without querying the sources.
+    assert not refresher.refresh()
+    sources.clear()
+    assert rates.get_cross_rates(today[0]).on_date == date.fromisoformat(date_a)
+    assert sources == [] and today[0] not in rates.RATES_CACHE
+    assert rates.get_cross_rates("2022-07-15").on_date == date.fromisoformat(date_a)
+    assert sources == ["2022-07-15", date_a]
+
+    def published(on_date):
+        if on_date <= today[0]:
+            return {"USD": 1, "EUR": 0.99}
+        return None
+
+    monkeypatch.setattr(rates, "get_day_rates_from_repo", published)
+    assert refresher.refresh()
+    assert rates.RATES_CACHE.pinned() == {today[0]}
+    assert rates.get_rate(today[0], Currency.EUR) == Dec("0.99")
+
+    # After midnight, the thread finds the rates of the new day.
+    refresher.start()
+    try:
+        today[0] = date(2022, 7, 17)
+        assert rates.get_cross_rates(today[0]).on_date == date(2022, 7, 16)
+        deadline = time.monotonic() + 5
+        while rates.RATES_CACHE.pinned() != {today[0]} and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert rates.RATES_CACHE.pinned() == {today[0]}
+        assert rates.get_cross_rates(today[0]).on_date == today[0]
+    finally:
+        refresher.stop()
+
+
+def test_recent_fallbacks_expire(tmp_cache, monkeypatch):
+    today = date.today()
+    old = today - timedelta(days=30)
+    published = {
+        today - timedelta(days=1): {"USD": 1, "EUR": 0.90},
+        old - timedelta(days=1): {"USD": 1, "EUR": 0.85},
+    }
+    monkeypatch.setattr(rates, "get_day_rates_from_repo", published.get)
+    monkeypatch.setattr(rates, "get_rates_range_from_supabase", lambda *args, **kwargs: {})
+    monkeypatch.delenv("DMON_EXCHANGERATE_API_KEY", raising=False)
+
+    # The fallback of a recent date is kept in memory for a while.
+    assert rates.get_rate(today, Currency.EUR) == Dec("0.90")
+    published[today] = {"USD": 1, "EUR": 0.95}
+    load_day_rates = rates.load_day_rates
+    monkeypatch.setattr(rates, "load_day_rates", None)
+    try:
+        assert rates.get_rate(today, Currency.EUR) == Dec("0.90")
+    finally:
+        monkeypatch.setattr(rates, "load_day_rates", load_day_rates)
+
+    # Once it expires, as does its resolution, the new rates are used.
+    monkeypatch.setattr(rates.RATE_RESOLUTIONS, "missing_ttl", -1)
+    rates.RATES_CACHE.put(today, rates.RATES_CACHE.get(today), ttl=-1)
+    assert rates.RATES_CACHE.get(today) is None
+    assert rates.get_rate(today, Currency.EUR) == Dec("0.95")
+    assert rates.RATES_CACHE.get(today).on_date == today
+
+    # The rates of old dates are not going to change.
+    assert rates.get_rate(old, Currency.EUR) == Dec("0.85")
+    assert old in rates.RATES_CACHE
+
+
+def test_env_file_settings(monkeypatch):
+    import dotenv
+
+    from dmon import metrics
+
+    settings = {"DMON_RATES_MEMORY_CACHE": "7", "DMON_SERVE_STALE_RATES": "1", "DMON_METRICS": "1"}
+    for name in settings:
+        monkeypatch.delenv(name, raising=False)
+
+    def load_dotenv():
+        for name, value in settings.items():
+            monkeypatch.setenv(name, value)
+
+    monkeypatch.setattr(dotenv, "load_dotenv", load_dotenv)
+    monkeypatch.setattr(rates, "_ENV_LOADED", False)
+    monkeypatch.setattr(rates, "RATES_CACHE", rates.RatesCache())
+    monkeypatch.setattr(rates, "TODAY_REFRESHER", rates.TodayRefresher())
+    monkeypatch.setattr(metrics, "ENABLED", False)
+
+    # The settings in .env apply to the objects created on import.
+    rates.load_env()
+    assert rates.RATES_CACHE.maxsize == 7
+    assert rates.TODAY_REFRESHER.serve_stale
+    assert metrics.ENABLED
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+def test_forked_child_opens_its_own_connections(tmp_cache):
+    rates.cache_day_rates(date_a, {"USD": 1, "EUR": 0.995})
+    parent_pool = rates.get_connection_pool()
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover
+        try:
+            ok = rates.get_connection_pool() is not parent_pool and rates.select_day_rates(
+                date.fromisoformat(date_a)
+            )[Currency.EUR] == Dec("0.995")
+            os.write(write_fd, b"1" if ok else b"0")
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+    assert os.read(read_fd, 1) == b"1"
+    assert rates.get_connection_pool() is parent_pool